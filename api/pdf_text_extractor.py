@@ -1,18 +1,43 @@
 import os
-import json
 import datetime
 import sys
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+# Server root, resolved once so default paths don't depend on the process cwd
+_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+_DATA_JSON = os.path.join(_ROOT_DIR, 'data.json')
+
+from utils.json_store import update_json
+
+# Pages are OCR'd in parallel (one tesseract process each), so keep every
+# process single-threaded: tesseract's OpenMP threads only oversubscribe the
+# cores here. Set before pytesseract spawns anything so children inherit it.
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
 from pdf2image import convert_from_path
 import pytesseract
 
-def extract_text_from_pdf(pdf_path: str = None) -> str:
+def extract_page_text(image) -> str:
+    """
+    OCR a single rendered PDF page
+
+    Args:
+        image: PIL image of the page (from pdf2image)
+
+    Returns:
+        str: Text recognized on the page
+    """
+    return pytesseract.image_to_string(image)
+
+def extract_text_from_pdf(pdf_path: str = None, store: bool = True) -> str:
     """
     Extract text from a PDF file using OCR, print it to console, and store in data.json
     
     Args:
         pdf_path (str): Path to the PDF file. If None, uses 'files/original.pdf'
+        store (bool): Write the text to data.json. Callers that save it
+            themselves along with other keys pass False to avoid a second write
     
     Returns:
         str: Extracted text from the PDF
@@ -21,7 +46,7 @@ def extract_text_from_pdf(pdf_path: str = None) -> str:
     
     # Default to the original.pdf file if no path provided
     if pdf_path is None:
-        pdf_path = os.path.join('files', 'original.pdf')
+        pdf_path = os.path.join(_ROOT_DIR, 'files', 'original.pdf')
     
     # Check if file exists
     if not os.path.exists(pdf_path):
@@ -35,18 +60,21 @@ def extract_text_from_pdf(pdf_path: str = None) -> str:
         
         # Convert PDF to images
         print("🔄 Converting PDF to images for OCR processing...")
-        images = convert_from_path(pdf_path)
+        # pdftoppm renders page ranges in parallel processes
+        images = convert_from_path(pdf_path, thread_count=max(1, min(4, os.cpu_count() or 1)))
         
         print(f"📊 PDF has {len(images)} pages")
         extracted_text = ""
         
-        # Extract text from each page using OCR
-        for i, image in enumerate(images):
-            print(f"📖 Processing page {i + 1}/{len(images)} with OCR...")
-            
-            # Extract text from image using pytesseract
-            text = pytesseract.image_to_string(image)
-            
+        # OCR every page concurrently. pytesseract runs each page in its own
+        # tesseract subprocess, so threads give real parallelism; map() keeps
+        # the results in page order for the output below.
+        print(f"📖 Processing {len(images)} page(s) with OCR...")
+        max_workers = max(1, min(len(images), os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            page_texts = list(executor.map(extract_page_text, images))
+        
+        for i, text in enumerate(page_texts):
             if text.strip():
                 print(f"📄 Page {i + 1} extracted text:")
                 print("-" * 50)
@@ -67,7 +95,7 @@ def extract_text_from_pdf(pdf_path: str = None) -> str:
             print("⚠️  No text was extracted. This might be a scanned document with poor quality.", "warning")
         
         # Store the extracted text in data.json
-        if extracted_text:
+        if extracted_text and store:
             print("💾 Storing extracted text in data.json...")
             store_text_in_data_json(extracted_text, pdf_path)
         
@@ -87,23 +115,8 @@ def store_text_in_data_json(extracted_text: str, pdf_path: str):
         pdf_path (str): Path to the original PDF file
     """
     try:
-        # Read existing data.json if it exists
-        if os.path.exists('data.json'):
-            with open('data.json', 'r') as file:
-                try:
-                    data = json.load(file)
-                except json.JSONDecodeError:
-                    data = {}
-        else:
-            data = {}
-        
-        # Update the data with only the extracted text
-        data['extracted_text'] = extracted_text
-        
-        # Write updated data back to data.json
-        with open('data.json', 'w') as file:
-            json.dump(data, file, indent=4)
-        
+        # Locked merge + atomic swap, so a crash mid-write can't truncate data.json
+        update_json(_DATA_JSON, {'extracted_text': extracted_text})
         
         print(f"✅ Extracted text successfully stored in data.json")
         print(f"   - Text length: {len(extracted_text)} characters")
@@ -30,6 +30,8 @@ from api.pdf_text_extractor import extract_text_from_pdf
 
 # Import log capture
 from utils.log_capture import LogCapture, get_log_storage, parse_logs_to_json
+from utils.file_cleanup import clear_directory
+from utils.json_store import json_file_lock, read_json, write_json_atomic
 
 # Import for SVG/PNG conversion
 import cairosvg
@@ -355,10 +357,13 @@ def run_pipeline_with_logging(upload_id: str):
 
     # Phase 1: Run Steps 1-3 (common to both branches)
     initial_steps = [
-        "Step1",  # Remove duplicate paths
-        "Step2",  # Modify colors (lightgray and black)
-        "Step3",  # Add background
+        "Step1",    # Remove duplicate paths
+        "Step2_3",  # Modify colors (lightgray and black) + add background
     ]
+    # Steps that don't live in processors/<name>.py
+    step_files = {
+        "Step2_3": "processors/pipeline.py",  # Step2 + Step3 fused in memory
+    }
 
     successful_steps = 0
     total_steps = len(initial_steps)
@@ -372,7 +377,7 @@ def run_pipeline_with_logging(upload_id: str):
 
     # Run initial steps
     for step in initial_steps:
-        success = run_single_step(step)
+        success = run_single_step(step, step_files.get(step))
         if success:
             successful_steps += 1
         else:
@@ -606,14 +611,7 @@ def run_pipeline_with_logging(upload_id: str):
             print(f"\n{'='*60}")
             print("🧹 Cleaning up files/")
             print(f"{'='*60}")
-            removed_count = 0
-            for f in os.listdir(files_dir):
-                filepath = os.path.join(files_dir, f)
-                if os.path.isdir(filepath):
-                    shutil.rmtree(filepath)
-                else:
-                    os.remove(filepath)
-                removed_count += 1
+            removed_count = clear_directory(files_dir)
             print(f"  Removed {removed_count} files/directories — files/ is now empty")
     except Exception as e:
         print(f"⚠️  Cleanup error: {e}")
@@ -766,13 +764,7 @@ async def process_ai_takeoff_sync(upload_id: str, company: str = None, jobsite:
         # Wipe files/ from any previous run so leftover artifacts can't shadow this one
         try:
             files_dir = "files"
-            if os.path.isdir(files_dir):
-                for f in os.listdir(files_dir):
-                    p = os.path.join(files_dir, f)
-                    if os.path.isdir(p):
-                        shutil.rmtree(p)
-                    else:
-                        os.remove(p)
+            clear_directory(files_dir)
             os.makedirs(os.path.join(files_dir, "tempData"), exist_ok=True)
             await log_to_client(upload_id, "🧹 Cleared files/ from previous run")
         except Exception as pre_clean_err:
@@ -867,6 +859,10 @@ async def process_ai_takeoff_sync(upload_id: str, company: str = None, jobsite:
                     extracted_text = extract_text_from_pdf(file_path)
                     if extracted_text:
                         await log_to_client(upload_id, f"✅ Text extracted successfully ({len(extracted_text)} characters)")
+                        # Rewrite in the background while the SVG pipeline runs;
+                        # Step14 picks the result up from the rewrite cache.
+                        from processors.Step14 import prefetch_rewrite
+                        prefetch_rewrite(extracted_text)
                     else:
                         await log_to_client(upload_id, f"⚠️  No text extracted from PDF", "warning")
                 except Exception as text_error:
@@ -890,23 +886,25 @@ async def process_ai_takeoff_sync(upload_id: str, company: str = None, jobsite:
                     # Parse logs into structured JSON format with timestamps
                     structured_logs = parse_logs_to_json(captured_logs, log_capture.start_time)
 
-                    # Save structured logs to data.json
+                    # Save structured logs to data.json. The updated dict is
+                    # handed straight to Step15 so it isn't re-read from disk.
                     data_json_path = os.path.join('data.json')
+                    data = None
                     if os.path.exists(data_json_path):
                         try:
-                            with open(data_json_path, 'r') as f:
-                                data = json.load(f)
+                            data = read_json(data_json_path)
 
                             data['processing_logs'] = structured_logs
                             data['processing_duration'] = processing_duration
                             data['processing_start_time'] = log_capture.start_time.isoformat()
                             data['processing_end_time'] = log_capture.end_time.isoformat()
 
-                            with open(data_json_path, 'w') as f:
-                                json.dump(data, f, indent=4)
+                            with json_file_lock(data_json_path):
+                                write_json_atomic(data_json_path, data)
 
                             print(f"✅ Saved {len(structured_logs)} log entries to data.json")
                         except Exception as log_error:
+                            data = None
                             print(f"⚠️  Could not save logs to data.json: {log_error}")
 
                     # Now run Step15 to send data (including logs) to database
@@ -916,15 +914,15 @@ async def process_ai_takeoff_sync(upload_id: str, company: str = None, jobsite:
                         print(f"{'='*60}")
                         try:
                             from processors.Step15 import run_step15
-                            step15_success = run_step15()
+                            step15_success = run_step15(data=data)
                             if step15_success:
                                 print("✅ Step15 completed - Results sent to database")
 
                                 # After Step15 creates the database record, update it with SVG URLs
                                 try:
-                                    # Re-read data.json to get the tracking_url created by Step15
-                                    with open('data.json', 'r') as f:
-                                        data_updated = json.load(f)
+                                    # Step15 sets tracking_url on the dict it was given;
+                                    # only fall back to re-reading data.json without one
+                                    data_updated = data if data is not None else read_json('data.json')
 
                                     tracking_url = data_updated.get('tracking_url')
 
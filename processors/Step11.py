@@ -22,6 +22,18 @@ _BG_4E_RECT_RE = re.compile(
     re.IGNORECASE,
 )
 
+# Tag/attribute scanners shared by the shore-marker and beam passes. Compiled
+# once at import instead of on every call (mark_alum_beams_by_dimension alone
+# runs once per beam class).
+_PATH_TAG_RE = re.compile(r'<path\b[^>]*>')
+_D_ATTR_RE = re.compile(r'\bd="([^"]*)"')
+_ID_ATTR_RE = re.compile(r'\bid="([^"]+)"')
+_STYLE_ATTR_RE = re.compile(r'\bstyle="([^"]*)"')
+_VIEWBOX_RE = re.compile(r'viewBox="([^"]*)"')
+_STYLE_FILL_RE = re.compile(r'fill\s*:\s*([^;"]+)', re.IGNORECASE)
+_STYLE_STROKE_HEX_RE = re.compile(r'stroke\s*:\s*#[0-9a-fA-F]{3,6}')
+_STYLE_STROKE_RE = re.compile(r'stroke\s*:\s*[^;"]+')
+
 def load_green_frames(json_path):
     """Load green frames data from JSON file"""
     try:
@@ -77,10 +89,13 @@ def load_yellow_frames(json_path):
         return None
 
 def read_svg_file(svg_path):
-    """Read SVG file content"""
+    """Read SVG file content.
+
+    Read as bytes and decode once: skips the text-mode wrapper's incremental
+    decoder and newline translation pass over a multi-MB file."""
     try:
-        with open(svg_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        with open(svg_path, 'rb') as f:
+            return f.read().decode('utf-8')
     except Exception as e:
         return None
 
@@ -165,14 +180,11 @@ def build_shore_markers(svg_content):
     """Return [(world_cx, world_cy, angle_deg), ...] for every rotated-square
     post-shore marker in svg_content, in world (viewBox) coords."""
     _parent_of, xform_by_id = _build_parent_and_transform_maps(svg_content)
-    path_pattern = re.compile(r'<path\b[^>]*>')
-    d_pattern = re.compile(r'\bd="([^"]*)"')
-    id_pattern = re.compile(r'\bid="([^"]+)"')
     markers = []
-    for m in path_pattern.finditer(svg_content):
+    for m in _PATH_TAG_RE.finditer(svg_content):
         tag = m.group(0)
-        d_m = d_pattern.search(tag)
-        id_m = id_pattern.search(tag)
+        d_m = _D_ATTR_RE.search(tag)
+        id_m = _ID_ATTR_RE.search(tag)
         if not (d_m and id_m):
             continue
         info = _shore_marker_angle(d_m.group(1))
@@ -359,8 +371,7 @@ def add_containers_to_svg(svg_content, green_rectangles, pink_rectangles, x_shap
     svg_tag = svg_content[svg_start_pos:svg_tag_end + 1]
     
     # Try to extract viewBox dimensions
-    import re
-    viewbox_match = re.search(r'viewBox="([^"]*)"', svg_tag)
+    viewbox_match = _VIEWBOX_RE.search(svg_tag)
     if viewbox_match:
         viewbox = viewbox_match.group(1).split()
         if len(viewbox) >= 4:
@@ -386,13 +397,14 @@ def add_containers_to_svg(svg_content, green_rectangles, pink_rectangles, x_shap
        style="fill:#1c1c1c;stroke:none" />
     '''
     
-    # Insert background right after the opening <svg> tag
+    # Background goes right after the opening <svg> tag, containers right
+    # before the closing </svg>; both splice points are located in the original
+    # content and the output is assembled in a single join at the end.
     svg_tag_end_pos = svg_content.find('>', svg_start_pos) + 1
-    svg_with_background = svg_content[:svg_tag_end_pos] + '\n' + background_element + svg_content[svg_tag_end_pos:]
     
     # Find the closing </svg> tag
-    svg_end_pos = svg_with_background.rfind('</svg>')
-    if svg_end_pos == -1:
+    svg_end_pos = svg_content.rfind('</svg>')
+    if svg_end_pos < svg_tag_end_pos:
         print("Error: Could not find closing </svg> tag")
         return None
     
@@ -434,19 +446,38 @@ def add_containers_to_svg(svg_content, green_rectangles, pink_rectangles, x_shap
     for rect in yellow_rectangles:
         container_elements.append(create_rectangle_element(rect, color='#ffff00', prefix='yellow_container'))
 
-    # Insert container elements before closing </svg> tag
-    containers_svg = '\n'.join(container_elements)
-    modified_svg = svg_with_background[:svg_end_pos] + '\n' + containers_svg + '\n' + svg_with_background[svg_end_pos:]
+    # Insert background after <svg> and container elements before closing </svg> tag.
+    # Elements are interleaved straight into the parts list, so the only string
+    # built is the final document.
+    parts = [
+        svg_content[:svg_tag_end_pos], '\n', background_element,
+        svg_content[svg_tag_end_pos:svg_end_pos], '\n',
+    ]
+    for element in container_elements:
+        parts += (element, '\n')
+    parts.append(svg_content[svg_end_pos:])
+    modified_svg = ''.join(parts)
     
     return modified_svg
 
 def save_svg_file(svg_content, output_path):
-    """Save SVG content to file"""
+    """Save SVG content to file.
+
+    `svg_content` may be a single string or an iterable of string chunks. The
+    data is written to a sibling temp file and moved into place with os.replace,
+    so a crash mid-write never leaves a truncated Step11.svg behind."""
+    tmp_path = f"{output_path}.tmp"
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(svg_content)
+        chunks = [svg_content] if isinstance(svg_content, str) else svg_content
+        with open(tmp_path, 'wb', buffering=1 << 20) as f:
+            f.writelines(chunk.encode('utf-8') for chunk in chunks)
+        os.replace(tmp_path, output_path)
         return True
     except Exception as e:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
         return False
 
 def convert_svg_to_png(svg_path, png_path):
@@ -642,14 +673,11 @@ def _build_parallel_pool(svg_content, xform_by_id):
     WORLD coords) as (path_id, angle_deg, x1, y1, x2, y2). Used as the pool of
     potential partner rails — a beam's opposite rail may be short or split into
     pieces, so we can't restrict partners to beam-length segments."""
-    path_pattern = re.compile(r'<path\b[^>]*>')
-    d_pattern = re.compile(r'\bd="([^"]*)"')
-    id_pattern = re.compile(r'\bid="([^"]+)"')
     pool = []
-    for m in path_pattern.finditer(svg_content):
+    for m in _PATH_TAG_RE.finditer(svg_content):
         tag = m.group(0)
-        d_m = d_pattern.search(tag)
-        id_m = id_pattern.search(tag)
+        d_m = _D_ATTR_RE.search(tag)
+        id_m = _ID_ATTR_RE.search(tag)
         if not (d_m and id_m):
             continue
         path_id = id_m.group(1)
@@ -667,7 +695,17 @@ def _build_parallel_pool(svg_content, xform_by_id):
     return pool
 
 
-def mark_alum_beams_by_dimension(svg_content, target_dimension, stroke_color, tolerance=0):
+def build_beam_geometry(svg_content):
+    """Parse the SVG once and return (xform_by_id, partner_pool) for
+    mark_alum_beams_by_dimension. Beam marking only rewrites stroke colors, so
+    ids, path data and transforms — and therefore this geometry — stay valid
+    across every beam class and can be shared between calls."""
+    _parent_of, xform_by_id = _build_parent_and_transform_maps(svg_content)
+    partner_pool = _build_parallel_pool(svg_content, xform_by_id)
+    return xform_by_id, partner_pool
+
+
+def mark_alum_beams_by_dimension(svg_content, target_dimension, stroke_color, tolerance=0, geometry=None):
     """Turn the stroke color of any <path> whose straight run matches
     target_dimension AND has at least one parallel same-dimension partner rail
     nearby. Returns (updated_svg_content, changed_count).
@@ -676,25 +714,27 @@ def mark_alum_beams_by_dimension(svg_content, target_dimension, stroke_color, to
     it has a parallel partner: real aluminum beams are always two parallel
     rails, whereas a lone matching line is usually a dimension/construction line
     that merely shares a beam's nominal length.
-    """
-    path_pattern = re.compile(r'<path\b[^>]*>')
-    style_pattern = re.compile(r'\bstyle="([^"]*)"')
-    d_pattern = re.compile(r'\bd="([^"]*)"')
-    id_pattern = re.compile(r'\bid="([^"]+)"')
 
-    # Build ancestor-transform map so we can convert local path coords → world.
-    _parent_of, xform_by_id = _build_parent_and_transform_maps(svg_content)
+    `geometry` is an optional (xform_by_id, partner_pool) pair from
+    build_beam_geometry; pass it when marking several beam classes on the same
+    drawing to skip re-parsing the SVG on every call.
+    """
+    # Ancestor-transform map (local path coords → world) plus the pool of all
+    # long straight segments that can act as a partner rail.
+    if geometry is None:
+        geometry = build_beam_geometry(svg_content)
+    xform_by_id, partner_pool = geometry
 
     # Pass 1: collect candidate rails (geometry + fill guard). A single path may
     # contain several matching segments, so every one is registered. Each is
     # stored as (path_id, angle_deg, x1, y1, x2, y2) in WORLD coords, angle in
     # [0,180). path_id repeats across a path's segments — recoloring keys on it.
     candidates = []
-    for m in path_pattern.finditer(svg_content):
+    for m in _PATH_TAG_RE.finditer(svg_content):
         tag = m.group(0)
-        d_m = d_pattern.search(tag)
-        st_m = style_pattern.search(tag)
-        id_m = id_pattern.search(tag)
+        d_m = _D_ATTR_RE.search(tag)
+        st_m = _STYLE_ATTR_RE.search(tag)
+        id_m = _ID_ATTR_RE.search(tag)
         if not (d_m and st_m and id_m):
             continue
 
@@ -704,7 +744,7 @@ def mark_alum_beams_by_dimension(svg_content, target_dimension, stroke_color, to
             continue
 
         style_value = st_m.group(1)
-        fill_m = re.search(r'fill\s*:\s*([^;"]+)', style_value, re.IGNORECASE)
+        fill_m = _STYLE_FILL_RE.search(style_value)
         fill_val = fill_m.group(1).strip().lower() if fill_m else ''
         if fill_val and fill_val != 'none':
             continue
@@ -724,10 +764,6 @@ def mark_alum_beams_by_dimension(svg_content, target_dimension, stroke_color, to
             angle = _seg_angle_deg(wx1, wy1, wx2, wy2)
             candidates.append((path_id, angle, wx1, wy1, wx2, wy2))
 
-    # Pool of ALL long parallel-partner-eligible segments (any length), so a
-    # beam's opposite rail counts even when it's short or split into pieces.
-    partner_pool = _build_parallel_pool(svg_content, xform_by_id)
-
     # Pass 2: keep a candidate rail if it has a parallel partner. A partner is
     # any DIFFERENT-path segment that is parallel (angle within tol), offset from
     # it, and overlapping along the shared direction — AND EITHER sits within the
@@ -777,8 +813,8 @@ def mark_alum_beams_by_dimension(svg_content, target_dimension, stroke_color, to
     def replace_path(match):
         nonlocal changed_count
         tag = match.group(0)
-        id_m = id_pattern.search(tag)
-        st_m = style_pattern.search(tag)
+        id_m = _ID_ATTR_RE.search(tag)
+        st_m = _STYLE_ATTR_RE.search(tag)
         if not (id_m and st_m):
             return tag
         if id_m.group(1) not in keepers:
@@ -788,17 +824,19 @@ def mark_alum_beams_by_dimension(svg_content, target_dimension, stroke_color, to
         if f'stroke:{stroke_color}'.lower() in style_value.lower():
             return tag
 
-        if re.search(r'stroke\s*:\s*#[0-9a-fA-F]{3,6}', style_value):
-            updated_style = re.sub(r'stroke\s*:\s*#[0-9a-fA-F]{3,6}', f'stroke:{stroke_color}', style_value)
-        elif 'stroke:' in style_value:
-            updated_style = re.sub(r'stroke\s*:\s*[^;"]+', f'stroke:{stroke_color}', style_value)
-        else:
-            updated_style = style_value + f';stroke:{stroke_color}'
+        # One subn pass both detects and rewrites a hex stroke; the generic
+        # stroke pattern only runs when no hex value was present.
+        updated_style, n_hex = _STYLE_STROKE_HEX_RE.subn(f'stroke:{stroke_color}', style_value)
+        if not n_hex:
+            if 'stroke:' in style_value:
+                updated_style = _STYLE_STROKE_RE.sub(f'stroke:{stroke_color}', style_value)
+            else:
+                updated_style = style_value + f';stroke:{stroke_color}'
 
         changed_count += 1
         return tag.replace(st_m.group(0), f'style="{updated_style}"', 1)
 
-    updated_svg = path_pattern.sub(replace_path, svg_content)
+    updated_svg = _PATH_TAG_RE.sub(replace_path, svg_content)
     # `keepers` is the set of ORIGINAL path ids recolored to this beam class —
     # returned so callers can map path id -> classification without re-scraping
     # colors from the SVG (white #ffffff is shared with non-beam paths).
@@ -951,6 +989,10 @@ def run_step11():
         ("alumBeam5", 376, 2, "#4084FF"),
     ]
 
+    # Parse the drawing once for all 14 beam classes: recoloring strokes never
+    # changes the transforms or segments the partner check relies on.
+    beam_geometry = build_beam_geometry(modified_svg)
+
     beam_counts = {}
     identified = {}   # element id -> classification label (path id for beams)
     for beam_key, beam_dimension, beam_tolerance, beam_color in beam_specs:
@@ -959,6 +1001,7 @@ def run_step11():
             beam_dimension,
             beam_color,
             beam_tolerance,
+            geometry=beam_geometry,
         )
         beam_counts[beam_key] = beam_count
         for pid in beam_ids:
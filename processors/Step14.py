@@ -6,7 +6,11 @@ Extracts text from the original.pdf using OCR and uses Google Gemini to rewrite
 
 import os
 import sys
-import json
+import re
+import hashlib
+import threading
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -17,129 +21,253 @@ load_dotenv()
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from api.pdf_text_extractor import extract_text_from_pdf
+from utils.json_store import key_lock, load_json, update_json, write_json_atomic
+from processors.Step15 import check_api_reachable
+
+# Server paths, resolved once from this file so the step works from any cwd
+_ROOT_DIR = Path(__file__).resolve().parent.parent
+_DATA_JSON = _ROOT_DIR / 'data.json'
+_PDF_PATH = _ROOT_DIR / 'files' / 'original.pdf'
+
+# Gemini model used for the rewrite. Bump PROMPT_VERSION whenever the prompt
+# or generation settings change so stale cached rewrites are not reused.
+GEMINI_MODEL = 'gemini-2.5-flash'
+PROMPT_VERSION = 2
+
+# Rewrites are cached on disk keyed by a hash of the normalized OCR text, model
+# and prompt version, so re-processing the same drawing skips the Gemini round
+# trip. Lives outside files/, which the pipeline wipes on every run. Set
+# GEMINI_CACHE_DIR to relocate it, or GEMINI_NO_CACHE=1 (--no-cache) to bypass.
+REWRITE_CACHE_DIR = Path(os.getenv(
+    'GEMINI_CACHE_DIR',
+    _ROOT_DIR / '.cache' / 'gemini_rewrite'
+))
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def _rewrite_cache_enabled() -> bool:
+    """False when GEMINI_NO_CACHE is set"""
+    return os.getenv('GEMINI_NO_CACHE', '').lower() not in ('1', 'true', 'yes')
+
+def _rewrite_cache_path(extracted_text: str) -> Path:
+    """Cache file for the rewrite of this OCR text (whitespace/case-insensitive)"""
+    normalized = _WHITESPACE_RE.sub(' ', extracted_text).strip().lower()
+    digest = hashlib.sha256()
+    digest.update(f"{GEMINI_MODEL}\0{PROMPT_VERSION}\0".encode('utf-8'))
+    digest.update(normalized.encode('utf-8'))
+    return REWRITE_CACHE_DIR / f"{digest.hexdigest()}.json"
+
+def load_cached_rewrite(extracted_text: str):
+    """Return the cached rewrite for extracted_text, or None"""
+    if not _rewrite_cache_enabled():
+        return None
+    entry = load_json(str(_rewrite_cache_path(extracted_text)))
+    if isinstance(entry, dict):
+        return entry.get('rewritten') or None
+    return None
+
+def store_cached_rewrite(extracted_text: str, rewritten_text: str, verbose: bool = True):
+    """Atomically store a rewrite in the on-disk cache"""
+    if not _rewrite_cache_enabled():
+        return
+    try:
+        REWRITE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(str(_rewrite_cache_path(extracted_text)), {
+            'rewritten': rewritten_text,
+            'model': GEMINI_MODEL,
+            'prompt_version': PROMPT_VERSION,
+            'created_at': datetime.now().isoformat(),
+        })
+    except OSError as e:
+        if verbose:
+            print(f"⚠️  Could not cache rewritten text: {e}")
+
+# Rewrite instructions, sent once as Gemini's system instruction. The user turn
+# carries only the OCR text, so no instructions are repeated per request.
+REWRITE_SYSTEM_INSTRUCTION = """You are an expert construction documentation specialist (scaffolding, shoring, structural engineering, construction drawings).
+
+You receive OCR text from a construction drawing, usually scaffolding/shoring plans. Rewrite it as a comprehensive, professional construction document:
+
+1. Fix OCR errors while keeping every technical value.
+2. Expand and explain every detail: what each measurement, structural element, specification, load rating, safety note and engineering note means and why it matters. Aim for 5-10x the length of the input; never summarize.
+3. Organize under clear headers: Project Information, Structural Specifications, Material Requirements, Dimensions and Elevations, Load Specifications, Installation Requirements, Safety and Compliance Notes, Engineering Requirements, Quality Standards.
+4. Use proper construction terminology, explain abbreviations in parentheses and format measurements consistently, e.g.:
+   - "EL. 230.17" -> "Elevation 230.17 feet above datum, the top height of the shoring structure at this location"
+   - "4X6" -> "4-inch by 6-inch dimensional lumber joists, heavy-duty structural grade"
+   - "@ 19.2" O/C" -> "Spaced at 19.2 inches on center, providing uniform load distribution"
+   - "10 K/LEG" -> "10 kip (10,000 pounds) load capacity per leg"
+"""
+
+# User turn: the (possibly clipped) OCR text
+REWRITE_PROMPT_TEMPLATE = """RAW OCR TEXT FROM CONSTRUCTION DRAWING:
+{extracted_text}"""
+
+# Upper bound on OCR characters sent to Gemini (~4 chars per token). Longer text
+# keeps its head and tail, which carry the title block and general notes.
+MAX_PROMPT_TEXT_CHARS = int(os.getenv('GEMINI_MAX_INPUT_CHARS', '48000'))
 
-def rewrite_text_with_gemini(extracted_text: str) -> str:
+def clip_prompt_text(extracted_text: str, max_chars: int = MAX_PROMPT_TEXT_CHARS, verbose: bool = True) -> str:
+    """Keep the head and tail of extracted_text when it exceeds max_chars"""
+    if len(extracted_text) <= max_chars:
+        return extracted_text
+    half = max_chars // 2
+    if verbose:
+        print(f"✂️  OCR text is {len(extracted_text)} chars; sending first and last {half} to Gemini")
+    return extracted_text[:half] + "\n...\n" + extracted_text[-half:]
+
+def rewrite_text_with_gemini(extracted_text: str, verbose: bool = True) -> str:
     """
     Use Google Gemini API to rewrite the extracted text professionally for scaffolding drawings
 
     Args:
         extracted_text: Raw OCR text from the PDF
+        verbose: Print progress and errors (off for the background prefetch,
+            whose output would interleave with the pipeline's captured logs)
 
     Returns:
         Professionally rewritten text or original text if API call fails
     """
     # Honor SKIP_GEMINI=1 for local/dev runs that shouldn't burn API quota.
     if os.getenv('SKIP_GEMINI'):
-        print("⏭️  SKIP_GEMINI set — using extracted text as-is")
+        if verbose:
+            print("⏭️  SKIP_GEMINI set — using extracted text as-is")
         return extracted_text
 
+    if not _rewrite_cache_enabled():
+        return _generate_rewrite(extracted_text, verbose)
+
+    # Lookup + generate under an in-process lock per entry: if a prefetch for
+    # the same text is already in flight (see prefetch_rewrite), wait for it and
+    # reuse its result instead of issuing a second Gemini request. Entries are
+    # written with write_json_atomic, so the read itself needs no file lock.
+    with key_lock(str(_rewrite_cache_path(extracted_text))):
+        cached_text = load_cached_rewrite(extracted_text)
+        if cached_text:
+            if verbose:
+                print("♻️  Using cached Gemini rewrite for identical extracted text")
+            return cached_text
+        return _generate_rewrite(extracted_text, verbose)
+
+def prefetch_rewrite(extracted_text: str):
+    """
+    Start the Gemini rewrite for extracted_text on a background thread
+
+    The result lands in the rewrite cache, so when Step14 later OCRs the same
+    PDF its rewrite_text_with_gemini call is a cache hit (or waits on the
+    in-flight request) instead of starting the API round trip from scratch.
+    The prefetch runs quietly; Step14's own call reports the outcome.
+
+    Returns:
+        The started thread, or None if there is nothing to prefetch
+    """
+    if not extracted_text or os.getenv('SKIP_GEMINI') or not _rewrite_cache_enabled():
+        return None
+    thread = threading.Thread(
+        target=rewrite_text_with_gemini,
+        args=(extracted_text,),
+        kwargs={'verbose': False},
+        name='gemini-rewrite-prefetch',
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+def _stream_rewrite(client, types, text: str, verbose: bool = True) -> str:
+    """Stream one Gemini rewrite of text and return the joined response"""
+    # Call Gemini API (using gemini-2.5-flash for fast and high-quality processing).
+    # Stream the response so chunks are consumed as they are generated
+    # instead of holding one blocking request open for the whole output.
+    stream = client.models.generate_content_stream(
+        model=GEMINI_MODEL,
+        contents=REWRITE_PROMPT_TEMPLATE.format(extracted_text=text),
+        config=types.GenerateContentConfig(
+            system_instruction=REWRITE_SYSTEM_INSTRUCTION,
+            temperature=0.5,  # Slightly higher for more detailed creative expansion
+            max_output_tokens=8000,  # Increased significantly for detailed output
+        )
+    )
+
+    # Extract the rewritten text, printing a progress dot per streamed chunk
+    chunks = []
+    if verbose:
+        print("   Receiving", end='', flush=True)
+    for chunk in stream:
+        if chunk.text:
+            chunks.append(chunk.text)
+            if verbose:
+                print('.', end='', flush=True)
+    rewritten_text = ''.join(chunks).strip()
+    if verbose:
+        print(f" {len(rewritten_text)} chars")
+    return rewritten_text
+
+@lru_cache(maxsize=4)
+def _get_genai_client(api_key: str):
+    """Gemini client memoized per API key.
+
+    The client owns an httpx connection pool, so reusing it keeps the TLS
+    session to the Gemini endpoint alive across rewrites instead of
+    handshaking on every call."""
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+def _generate_rewrite(extracted_text: str, verbose: bool = True) -> str:
+    """Call Gemini for the rewrite (no cache lookup); falls back to extracted_text"""
     try:
-        from google import genai
         from google.genai import types
 
         # Get API key from environment
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key:
-            print("⚠️  GEMINI_API_KEY not found in environment variables")
-            print("   Skipping Gemini rewriting, using extracted text as-is")
+            if verbose:
+                print("⚠️  GEMINI_API_KEY not found in environment variables")
+                print("   Skipping Gemini rewriting, using extracted text as-is")
             return extracted_text
 
-        print("\n🤖 Rewriting text with Google Gemini API...")
-
-        # Initialize Gemini client
-        client = genai.Client(api_key=api_key)
-
-        # Create the prompt for professional rewriting
-        prompt = f"""You are an expert construction documentation specialist with deep knowledge of scaffolding, shoring, structural engineering, and construction drawings.
-
-The text below was extracted from a construction drawing (likely scaffolding/shoring plans) using OCR. It contains technical specifications, measurements, elevations, materials, safety notes, and engineering requirements.
-
-YOUR TASK: Transform this into a COMPREHENSIVE, DETAILED, PROFESSIONAL construction document that:
-
-1. **EXPAND AND EXPLAIN** - Don't just fix errors, ELABORATE on every detail:
-   - Explain what each measurement means and its purpose
-   - Describe the structural elements and their function
-   - Clarify technical specifications and their significance
-   - Expand on safety requirements and compliance standards
-   - Add context to engineering notes and calculations
-
-2. **ORGANIZE INTO DETAILED SECTIONS** with clear headers:
-   - Project Information (complete details)
-   - Structural Specifications (detailed descriptions)
-   - Material Requirements (comprehensive list with specifications)
-   - Dimensions and Elevations (organized by area/section)
-   - Load Specifications (detailed load calculations)
-   - Installation Requirements (step-by-step guidance)
-   - Safety and Compliance Notes (expanded explanations)
-   - Engineering Requirements (detailed professional requirements)
-   - Quality Standards (material grades and specifications)
-
-3. **BE VERY DETAILED** - Include:
-   - Full explanations of measurements (e.g., "EL. 230.17 elevation" → "Elevation 230.17 feet above datum, indicating the top height of the shoring structure at this location")
-   - Complete material specifications (e.g., "4X6" → "4-inch by 6-inch dimensional lumber joists, heavy-duty structural grade")
-   - Detailed spacing information (e.g., "@ 19.2" O/C" → "Spaced at 19.2 inches on center, providing uniform load distribution")
-   - Comprehensive load ratings (e.g., "10 K/LEG" → "10 kip (10,000 pounds) load capacity per leg")
-
-4. **PROFESSIONAL CONSTRUCTION LANGUAGE**:
-   - Use proper construction and engineering terminology
-   - Explain abbreviations in parentheses
-   - Format measurements consistently
-   - Use industry-standard notation
-
-5. **MAXIMUM DETAIL** - Write as much useful information as possible. The longer and more detailed, the better. Include:
-   - Every dimension with its purpose
-   - Every material with its grade and specification
-   - Every safety note with expanded explanation
-   - Every structural element with its function
-   - Every load rating with context
-
-6. **FIX OCR ERRORS** while maintaining all technical content
-
-IMPORTANT:
-- Write AT LEAST 5-10x more detailed than the original
-- Expand abbreviations and explain technical terms
-- Add context and explanations throughout
-- Be thorough and comprehensive - MORE DETAIL IS BETTER
-- DO NOT summarize or condense - EXPAND and ELABORATE
-
-RAW OCR TEXT FROM CONSTRUCTION DRAWING:
-{extracted_text}
-
-COMPREHENSIVE DETAILED PROFESSIONAL CONSTRUCTION DOCUMENT:"""
-
-        # Call Gemini API (using gemini-2.5-flash for fast and high-quality processing)
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.5,  # Slightly higher for more detailed creative expansion
-                max_output_tokens=8000,  # Increased significantly for detailed output
-            )
-        )
+        # The rewrite is only worth paying for if Step15 can deliver it
+        if not check_api_reachable():
+            if verbose:
+                print("⚠️  Results API is unreachable - skipping Gemini rewrite")
+                print("   Using extracted text as-is")
+            return extracted_text
 
-        # Extract the rewritten text
-        rewritten_text = response.text.strip()
+        if verbose:
+            print("\n🤖 Rewriting text with Google Gemini API...")
+
+        # Reuse the Gemini client (and its pooled connections) for this key
+        client = _get_genai_client(api_key)
+
+        # Clip very long OCR output so the request stays within the input
+        # budget. The whole text goes in one request: the system instruction
+        # organizes the entire drawing under one set of section headers
+        rewritten_text = _stream_rewrite(client, types, clip_prompt_text(extracted_text, verbose=verbose), verbose)
 
         # Validate that Gemini actually rewrote the text (not just returned the same)
         if rewritten_text == extracted_text or len(rewritten_text) < 50:
-            print("⚠️  Gemini returned text that appears unchanged or too short")
-            print("   Using extracted text as fallback")
+            if verbose:
+                print("⚠️  Gemini returned text that appears unchanged or too short")
+                print("   Using extracted text as fallback")
             return extracted_text
 
-        print("✅ Text successfully rewritten by Google Gemini")
-        print(f"   Original length: {len(extracted_text)} chars")
-        print(f"   Rewritten length: {len(rewritten_text)} chars")
+        store_cached_rewrite(extracted_text, rewritten_text, verbose)
+
+        if verbose:
+            print("✅ Text successfully rewritten by Google Gemini")
+            print(f"   Original length: {len(extracted_text)} chars")
+            print(f"   Rewritten length: {len(rewritten_text)} chars")
         return rewritten_text
 
     except ImportError:
-        print("⚠️  Google Genai package not installed. Run: pip install google-genai")
-        print("   Using extracted text as-is")
+        if verbose:
+            print("⚠️  Google Genai package not installed. Run: pip install google-genai")
+            print("   Using extracted text as-is")
         return extracted_text
     except Exception as e:
-        print(f"⚠️  Error calling Google Gemini API: {e}")
-        print("   Using extracted text as fallback")
-        import traceback
-        traceback.print_exc()
+        if verbose:
+            print(f"⚠️  Error calling Google Gemini API: {e}")
+            print("   Using extracted text as fallback")
+            import traceback
+            traceback.print_exc()
         return extracted_text
 
 def store_text_in_data_json(extracted_text: str, rewritten_text: str, pdf_path: str):
@@ -152,23 +280,12 @@ def store_text_in_data_json(extracted_text: str, rewritten_text: str, pdf_path:
         pdf_path: Path to the original PDF file
     """
     try:
-        # Read existing data.json if it exists
-        if os.path.exists('data.json'):
-            with open('data.json', 'r') as file:
-                try:
-                    data = json.load(file)
-                except json.JSONDecodeError:
-                    data = {}
-        else:
-            data = {}
-        
-        # Update the data with both texts
-        data['extracted_text'] = extracted_text
-        data['rewritten_text'] = rewritten_text
-        
-        # Write updated data back to data.json
-        with open('data.json', 'w') as file:
-            json.dump(data, file, indent=4)
+        # Locked read-modify-write with an atomic swap, so a concurrent writer
+        # can't lose these keys and a crash can't leave data.json truncated.
+        update_json(str(_DATA_JSON), {
+            'extracted_text': extracted_text,
+            'rewritten_text': rewritten_text,
+        })
         
         print(f"✅ Extracted and rewritten text successfully stored in data.json")
         print(f"   - Original text length: {len(extracted_text)} characters")
@@ -186,15 +303,7 @@ def run_step14():
         print("🚀 Step 11: Extracting and Rewriting Text from PDF")
         print("=" * 70)
         
-        # Get the current working directory to determine the correct paths
-        current_dir = os.getcwd()
-        
-        # If we're in the processors directory, use relative paths
-        if current_dir.endswith('processors'):
-            pdf_path = "../files/original.pdf"
-        else:
-            # If we're in the server directory (when called from pipeline), use direct paths
-            pdf_path = "files/original.pdf"
+        pdf_path = str(_PDF_PATH)
         
         # Check if PDF exists
         if not os.path.exists(pdf_path):
@@ -204,8 +313,9 @@ def run_step14():
         
         print(f"📄 Processing PDF: {pdf_path}")
         
-        # Extract text from the PDF
-        extracted_text = extract_text_from_pdf(pdf_path)
+        # Extract text from the PDF (stored together with the rewrite below
+        # in a single data.json write)
+        extracted_text = extract_text_from_pdf(pdf_path, store=False)
         
         if extracted_text:
             print("\n" + "=" * 70)
@@ -248,10 +358,10 @@ def main():
     return run_step14()
 
 if __name__ == "__main__":
-    # Change to the server directory to ensure proper file paths
-    server_dir = Path(__file__).parent.parent
-    os.chdir(server_dir)
-    
+    # --no-cache forces a fresh Gemini rewrite even if this OCR text was seen before
+    if '--no-cache' in sys.argv[1:]:
+        os.environ['GEMINI_NO_CACHE'] = '1'
+
     success = main()
     sys.exit(0 if success else 1)
 
@@ -1,51 +1,171 @@
 import re
 import os
 import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+# Resolved once from this file, so the step works from any working directory
+_FILES_DIR = Path(__file__).resolve().parent.parent / 'files'
+
+# Patterns compiled once at import instead of looked up in re's cache per call.
+# Tags carrying a #ffdf7f/#fb3205 stroke or fill are kept as they are (apart
+# from the #ffdf7f -> #000000 swap); every other stroke:/fill: hex color is
+# rewritten where it stands.
+_KEEP_RE = re.compile(r'(?:stroke|fill):#(?:ffdf7f|fb3205)')
+_PAINT_RE = re.compile(r'(?P<prop>stroke|fill):(?P<hex>#[0-9a-fA-F]{6})')
+# <text> start tags are found in one scan; the fill/stroke patterns then run
+# on each (short) tag instead of over the whole document
+_TEXT_TAG_RE = re.compile(r'<text[^<>]*>')
+_TEXT_FILL_RE = re.compile(r'(<text[^>]*style="[^"]*)fill:[#0-9a-fA-F]+')
+_TEXT_STROKE_RE = re.compile(r'(<text[^>]*style="[^"]*)stroke:[#0-9a-fA-F]+')
+_TEXT_OPEN_RE = re.compile(r'(<text(?![^>]*style=)[^>]*)>')
+
+# Colors that mark elements to keep (skipped by the recolor pass)
+_KEEP_COLORS = ('#ffdf7f', '#fb3205')
+
+
+def _swap_yellow_to_black(fragment):
+    """Change stroke/fill #ffdf7f to #000000 inside an untouched fragment"""
+    return fragment.replace('stroke:#ffdf7f', 'stroke:#000000').replace('fill:#ffdf7f', 'fill:#000000')
+
+
+def _keep_tag_spans(svg_text):
+    """
+    Locate the tags to leave untouched from the (rare) keep colors outward,
+    instead of trying a whole-tag regex at every '<' in the document.
+
+    Returns:
+        (spans, stray): (start, end) of each tag holding a #ffdf7f/#fb3205
+        stroke or fill, and whether such a color also appears outside a tag
+    """
+    spans = []
+    stray = False
+    # The text before each match is searched once: `last_gt` is the last '>'
+    # seen so far, `tag_start` the first '<' after it, `tag_end` the first '>'
+    # after the previous match. This keeps the lookup linear even for runs of
+    # keep colors with no tag around them, where a fresh rfind/find per match
+    # would rescan the document each time.
+    scanned = 0
+    last_gt = -1
+    tag_start = -1
+    tag_end = -1
+    for match in _KEEP_RE.finditer(svg_text):
+        pos = match.start()
+        if spans and pos < spans[-1][1]:
+            continue  # another keep color in the same tag
+        gt = svg_text.rfind('>', scanned, pos)
+        if gt != -1:
+            last_gt = gt
+            tag_start = svg_text.find('<', gt + 1, pos)
+        elif tag_start == -1:
+            tag_start = svg_text.find('<', max(scanned, last_gt + 1), pos)
+        scanned = pos
+        if tag_end < match.end():
+            tag_end = svg_text.find('>', match.end())
+            if tag_end == -1:
+                return spans, True  # no '>' left: every remaining match is stray
+        if tag_start == -1:
+            stray = True
+            continue
+        spans.append((tag_start, tag_end + 1))
+    return spans, stray
+
+
+# Recent results keyed by a digest of the input SVG and the colors, so a
+# long-running server re-processing the same drawing skips the rewrite.
+# Bounded: holds at most _RESULT_CACHE_SIZE rewritten SVGs.
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_SIZE = 8
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def clear_cache():
+    """Drop all cached modify_svg_stroke_and_fill results"""
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE.clear()
+
 
 # ====== SETTING ELEMENTS COLOR LIGHTGRAY AND BLACK SLABBANDS ====== #
 
 # This step is to modify the stroke and fill colors of the SVG file
 def modify_svg_stroke_and_fill(svg_text, black_stroke="#000000", white_stroke="#4e4e4e", new_stroke="#4e4e4e", fill_color="#4e4e4e"):
+    digest = hashlib.blake2b(svg_text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    key = (digest, black_stroke, white_stroke, new_stroke, fill_color)
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(key)
+        if cached is not None:
+            _RESULT_CACHE.move_to_end(key)
+            return cached
+
+    result = _recolor_svg(svg_text, black_stroke, white_stroke, new_stroke, fill_color)
+
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = result
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+    return result
+
+def _recolor_svg(svg_text, black_stroke, white_stroke, new_stroke, fill_color):
+    """Uncached body of modify_svg_stroke_and_fill"""
     try:
-        # Find and print IDs of elements with #ffdf7f
-        yellow_elements = re.finditer(r'<[^>]*?id="([^"]*)"[^>]*(?:stroke|fill):#ffdf7f[^>]*>', svg_text)
-        skipped_ids = set()
-        for match in yellow_elements:
-            if match.group(1):  # if ID exists
-                skipped_ids.add(match.group(1))
-        
-        # if skipped_ids:
-            # print("Skipped elements with #ffdf7f (by ID):", ", ".join(skipped_ids))
-
-        # Modify stroke colors, but skip elements with #ffdf7f and #fb3205
-        modified_svg_text = re.sub(
-            r'(?:<[^>]*(?:stroke|fill):#(?:ffdf7f|fb3205)[^>]*>)|(?:stroke:(#[0-9a-fA-F]{6}))',
-            lambda m: m.group(0) if any(color in m.group(0) for color in ['ffdf7f', 'fb3205']) else (
-                f"stroke:{new_stroke}" if m.group(1) == black_stroke else f"stroke:{white_stroke}"
-            ),
-            svg_text
-        )
-
-        # Modify fill colors, but skip elements with #ffdf7f and #fb3205
-        modified_svg_text = re.sub(
-            r'(?:<[^>]*(?:stroke|fill):#(?:ffdf7f|fb3205)[^>]*>)|(?:fill:(#[0-9a-fA-F]{6}))',
-            lambda m: m.group(0) if any(color in m.group(0) for color in ['ffdf7f', 'fb3205']) else f"fill:{fill_color}",
-            modified_svg_text
-        )
-
-        # Continue with text modifications
-        modified_svg_text = re.sub(r'(<text[^>]*style="[^"]*)fill:[#0-9a-fA-F]+', rf'\1fill:{new_stroke}', modified_svg_text)
-        modified_svg_text = re.sub(r'(<text[^>]*style="[^"]*)stroke:[#0-9a-fA-F]+', rf'\1stroke:{new_stroke}', modified_svg_text)
-        modified_svg_text = re.sub(r'(<text(?![^>]*style=)[^>]*)>', rf'\1 style="fill:{new_stroke}; stroke:{new_stroke}">', modified_svg_text)
-
-        # Change all #ffdf7f elements to #000000
-        modified_svg_text = re.sub(
-            r'(stroke|fill):#ffdf7f',
-            r'\1:#000000',
-            modified_svg_text
-        )
+        def recolor(m):
+            color = m.group('hex')
+            if color in _KEEP_COLORS:
+                return _swap_yellow_to_black(m.group(0))
+            if m.group('prop') == 'fill':
+                return f"fill:{fill_color}"
+            return f"stroke:{new_stroke}" if color == black_stroke else f"stroke:{white_stroke}"
+
+        spans, stray_keep = _keep_tag_spans(svg_text)
+        if new_stroke == white_stroke == fill_color and not stray_keep:
+            # Every stroke/fill gets the same color (the defaults), so a
+            # template substitution recolors inside the regex engine with no
+            # Python callback per match
+            recolor = rf'\g<prop>:{fill_color}'
+
+        # Modify stroke and fill colors between the kept tags, skipping
+        # elements with #ffdf7f and #fb3205 (whose #ffdf7f is changed to #000000)
+        parts = []
+        pos = 0
+        for tag_start, tag_end in spans:
+            parts.append(_PAINT_RE.sub(recolor, svg_text[pos:tag_start]))
+            parts.append(_swap_yellow_to_black(svg_text[tag_start:tag_end]))
+            pos = tag_end
+        parts.append(_PAINT_RE.sub(recolor, svg_text[pos:]))
+        modified_svg_text = ''.join(parts)
+
+        # Continue with text modifications: one pass over the <text> tags sets
+        # fill and stroke in an existing style, or adds a style if there is none
+        text_fill = rf'\1fill:{new_stroke}'
+        text_stroke = rf'\1stroke:{new_stroke}'
+        text_style = f' style="fill:{new_stroke}; stroke:{new_stroke}">'
+        malformed = False
+
+        def restyle_text(m):
+            nonlocal malformed
+            tag = m.group(0)
+            if 'style=' not in tag:
+                return tag[:-1] + text_style
+            style_at = tag.rfind('style="')
+            if style_at >= 0 and '"' not in tag[style_at + 7:]:
+                # Unclosed style value: the whole-document patterns would
+                # run on past this tag's '>'
+                malformed = True
+            tag = _TEXT_FILL_RE.sub(text_fill, tag, count=1)
+            return _TEXT_STROKE_RE.sub(text_stroke, tag, count=1)
+
+        restyled, tag_count = _TEXT_TAG_RE.subn(restyle_text, modified_svg_text)
+        if malformed or tag_count != modified_svg_text.count('<text'):
+            # A <text that isn't a well-formed start tag: fall back to the
+            # three whole-document passes so the result stays the same
+            restyled = _TEXT_FILL_RE.sub(text_fill, modified_svg_text)
+            restyled = _TEXT_STROKE_RE.sub(text_stroke, restyled)
+            restyled = _TEXT_OPEN_RE.sub(rf'\1{text_style}', restyled)
+        modified_svg_text = restyled
 
         return modified_svg_text
 
@@ -59,23 +179,12 @@ def run_step2():
     Main function to run Step2 processing
     """
     try:
-        # Get the current working directory to determine the correct paths
-        current_dir = os.getcwd()
-        
-        # If we're in the processors directory, use relative paths
-        if current_dir.endswith('processors'):
-            input_svg = "../files/Step1.svg"
-            output_svg = "../files/Step2.svg"
-        else:
-            # If we're in the server directory (when called from pipeline), use direct paths
-            input_svg = "files/Step1.svg"
-            output_svg = "files/Step2.svg"
+        input_svg = _FILES_DIR / 'Step1.svg'
+        output_svg = _FILES_DIR / 'Step2.svg'
         
         # Check if input file exists
-        if not os.path.exists(input_svg):
+        if not input_svg.exists():
             print(f"Error: Input file '{input_svg}' not found!")
-            print(f"Current working directory: {os.getcwd()}")
-            print(f"Tried path: {input_svg}")
             return False
         
         # Read the input file
@@ -1,27 +1,69 @@
-import re
 import os
 import sys
+import shutil
+from pathlib import Path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+# Resolved once from this file, so the step works from any working directory
+_FILES_DIR = Path(__file__).resolve().parent.parent / 'files'
+
+# Scan size while looking for the <svg> tag, and copy size for the remainder
+_SCAN_CHUNK_BYTES = 64 * 1024
+_COPY_CHUNK_BYTES = 1024 * 1024
+
+BACKGROUND_COLOR = "#202124"  # Gray background
+
+
+def add_background_to_svg_text(svg_text, background_color):
+    """
+    In-memory variant of add_background_to_svg: returns svg_text with the
+    background <rect> inserted after the opening <svg> tag.
+    """
+    start = svg_text.find('<svg')
+    end = svg_text.find('>', start) if start != -1 else -1
+    if end == -1:
+        return svg_text
+    end += 1
+    rect = f'<rect width="100%" height="100%" fill="{background_color}" />'
+    return svg_text[:end] + rect + svg_text[end:]
+
 
 def add_background_to_svg(input_file, output_file, background_color):
     """
     Adds a background color to the SVG by inserting a <rect> element.
+
+    Streams the file: bytes are read until the opening <svg> tag is complete,
+    the <rect> is written after it and the rest is copied through unchanged,
+    so memory use doesn't grow with the SVG size.
     """
     try:
-        with open(input_file, "r", encoding="utf-8") as file:
-            svg_text = file.read()
+        rect = f'<rect width="100%" height="100%" fill="{background_color}" />'.encode('utf-8')
+
+        with open(input_file, "rb") as src, open(output_file, "wb") as dst:
+            # Read until the '>' closing the first <svg tag is buffered
+            head = b''
+            insert_at = -1
+            while True:
+                chunk = src.read(_SCAN_CHUNK_BYTES)
+                head += chunk
+                start = head.find(b'<svg')
+                if start != -1:
+                    end = head.find(b'>', start)
+                    if end != -1:
+                        insert_at = end + 1
+                        break
+                if not chunk:
+                    break
 
-        # Insert a <rect> element after the opening <svg> tag
-        svg_text = re.sub(
-            r'(<svg[^>]*>)',
-            rf'\1<rect width="100%" height="100%" fill="{background_color}" />',
-            svg_text,
-            count=1
-        )
+            # Insert a <rect> element after the opening <svg> tag
+            if insert_at == -1:
+                dst.write(head)
+            else:
+                dst.write(head[:insert_at])
+                dst.write(rect)
+                dst.write(head[insert_at:])
 
-        with open(output_file, "w", encoding="utf-8") as file:
-            file.write(svg_text)
+            shutil.copyfileobj(src, dst, _COPY_CHUNK_BYTES)
 
     except Exception as e:
         
@@ -32,29 +74,16 @@ def run_step3():
     Main function to run Step3 processing
     """
     try:
-        # Get the current working directory to determine the correct paths
-        current_dir = os.getcwd()
-        
-        # If we're in the processors directory, use relative paths
-        if current_dir.endswith('processors'):
-            input_svg = "../files/Step2.svg"
-            output_svg = "../files/Step3.svg"
-        else:
-            # If we're in the server directory (when called from pipeline), use direct paths
-            input_svg = "files/Step2.svg"
-            output_svg = "files/Step3.svg"
-        
-        background_color = "#202124"  # Gray background
+        input_svg = _FILES_DIR / 'Step2.svg'
+        output_svg = _FILES_DIR / 'Step3.svg'
         
         # Check if input file exists
-        if not os.path.exists(input_svg):
+        if not input_svg.exists():
             
             print(f"Error: Input file '{input_svg}' not found!")
-            print(f"Current working directory: {os.getcwd()}")
-            print(f"Tried path: {input_svg}")
             return False
         
-        add_background_to_svg(input_svg, output_svg, background_color)
+        add_background_to_svg(input_svg, output_svg, BACKGROUND_COLOR)
         
         
         print(f"✅ Step3 completed successfully:")
@@ -2,18 +2,208 @@ import re
 import os
 import json
 import sys
+import mmap
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from colorama import init, Fore, Style
 from PatternComponents import shores_box, frames_6x4, frames_5x4, frames_inBox, shores, yellow_traffic_light
 import cairosvg
-import io
-from PIL import Image
+from bisect import bisect_left
+from functools import lru_cache, partial
+
+try:
+    import ahocorasick
+except ImportError:  # optional C automaton; the per-category regexes are the fallback
+    ahocorasick = None
+
+# Initialize colorama once (init() wraps stdout again on every call)
+init()
+
+# <path ...> start tags (scanned in the raw file bytes), and the d="..."
+# values inside one (once the tag is decoded)
+_PATH_TAG_RE = re.compile(rb'<path[^>]*>')
+_D_VALUE_RE = re.compile(r'd="([^"]*)"')
+
+# Output buffer for writing Step5.svg
+_WRITE_BUFFER_BYTES = 1 << 20
+
+# Paint values rewritten when a path is recolored
+_STROKE_VALUE_RE = re.compile(r'stroke:[#0-9a-fA-F]+')
+_FILL_VALUE_RE = re.compile(r'fill:[#0-9a-fA-F]+')
+_HEX_COLOR_RE = re.compile(r'#[0-9a-fA-F]{6}')
+
+
+def _alternation(variations):
+    """
+    Regex alternation of the literal variations, built once per category at
+    import. Duplicates (several lists repeat entries) are dropped and the
+    longest come first, so a shared prefix is tried on the longer literal.
+    """
+    unique = sorted(dict.fromkeys(variations), key=len, reverse=True)
+    return "|".join(re.escape(variation) for variation in unique)
+
+
+# Category patterns, matched against the d="..." values of each <path> tag.
+# Compiled once at import; with pyahocorasick installed they are only the
+# fallback for the automata below.
+_SHORES_BOX_RE = re.compile(_alternation(shores_box))
+_FRAMES6x4_RE = re.compile(_alternation(frames_6x4))
+_FRAMESINBOX_RE = re.compile(_alternation(frames_inBox))
+_YELLOW_RE = re.compile(_alternation(yellow_traffic_light))
+_SHORES_RE = re.compile(_alternation(shores))
+
+# Frames 5x4 including detection of diagonal segments: the generic diagonal
+# allows leg lengths from 294-301px (covers 294-299/300/301)
+_FRAMES5x4_GENERIC = r'h\s+(?:29[4-9]|30[0-1])\s+l\s+-?(?:29[4-9]|30[0-1]),-?(?:29[4-9]|30[0-1])'
+_FRAMES5x4_GENERIC_RE = re.compile(_FRAMES5x4_GENERIC, re.IGNORECASE)
+_FRAMES5x4_RE = re.compile(
+    rf'(?:{_alternation(frames_5x4)})|(?:{_FRAMES5x4_GENERIC})',
+    re.IGNORECASE)
+
+# Paths with lengths 294-300 or "V 9114" in their d parameter (pink candidates)
+_ADJ_294_300_RE = re.compile(r'\b(?:29[4-9]|300)\b|V\s+9114', re.IGNORECASE)
+
+# Categories whose variations are matched literally (frames 5x4 is matched
+# case-insensitively and has a generic diagonal pattern besides)
+_LITERAL_CATEGORIES = (
+    ('red', shores_box),
+    ('blue', shores),
+    ('green', frames_6x4),
+    ('orange', frames_inBox),
+    ('yellow', yellow_traffic_light),
+)
+
+
+@lru_cache(maxsize=1)
+def _variation_automata():
+    """
+    Aho-Corasick automata over the path-data variations, so one scan of a d
+    value finds every category it belongs to.
+
+    Returns:
+        (literal, frames5x4): the first maps each variation to the set of
+        categories listing it; the second holds the lowercased frames 5x4
+        variations, to be run over a lowercased d value
+    """
+    categories_by_variation = {}
+    for category, variations in _LITERAL_CATEGORIES:
+        for variation in variations:
+            categories_by_variation.setdefault(variation, set()).add(category)
+
+    literal = ahocorasick.Automaton()
+    for variation, categories in categories_by_variation.items():
+        literal.add_word(variation, frozenset(categories))
+    literal.make_automaton()
+
+    frames5x4 = ahocorasick.Automaton()
+    for variation in frames_5x4:
+        frames5x4.add_word(variation.lower(), True)
+    frames5x4.make_automaton()
+    return literal, frames5x4
+
+
+def _has_leg_length(d_value):
+    """
+    Cheap pre-check for the two true regexes (generic diagonal, adjacent
+    lengths): both need one of these digit runs, and most d values have
+    none, so the regex call is skipped for them
+    """
+    return '29' in d_value or '30' in d_value or '9114' in d_value
+
+
+def _classify_with_regexes(d_value):
+    """Categories of one d value, one regex search per category"""
+    found = {category for category, pattern in (
+        ('red', _SHORES_BOX_RE),
+        ('blue', _SHORES_RE),
+        ('green', _FRAMES6x4_RE),
+        ('orange', _FRAMESINBOX_RE),
+        ('yellow', _YELLOW_RE),
+    ) if pattern.search(d_value)}
+    if _FRAMES5x4_RE.search(d_value):
+        found.add('pink')
+    return found
+
+
+def _classify_with_automata(d_value):
+    """Categories of one d value, from a single automaton scan"""
+    if not d_value.isascii():
+        # re's case folding covers a few non-ASCII letters that str.lower()
+        # doesn't map onto the ASCII variations
+        return _classify_with_regexes(d_value)
+    literal, frames5x4 = _variation_automata()
+    found = set()
+    for _, categories in literal.iter(d_value):
+        found |= categories
+    if (any(True for _ in frames5x4.iter(d_value.lower()))
+            or (_has_leg_length(d_value) and _FRAMES5x4_GENERIC_RE.search(d_value))):
+        found.add('pink')
+    return found
+
+
+_classify = _classify_with_regexes if ahocorasick is None else _classify_with_automata
+
+
+def _recolor_path_tag(path_tag, color, style_hex=False):
+    """
+    Set a <path> tag's stroke and fill to color: stroke:/fill: values are
+    rewritten in place, or a stroke='..'/fill='..' attribute is added when
+    the tag doesn't mention stroke/fill at all. With style_hex, every
+    #rrggbb inside style="..." becomes color too.
+    """
+    if "stroke" in path_tag:
+        path_tag = _STROKE_VALUE_RE.sub(lambda m: f'stroke:{color}', path_tag)
+    else:
+        path_tag = path_tag.replace("<path", f"<path stroke='{color}'", 1)
+    # Checked after the stroke pass, which can swallow the "f" of a
+    # following "fill" when there is no separator between them
+    if "fill" in path_tag:
+        path_tag = _FILL_VALUE_RE.sub(lambda m: f'fill:{color}', path_tag)
+    else:
+        path_tag = path_tag.replace("<path", f"<path fill='{color}'", 1)
+    if style_hex and '#' in path_tag:
+        path_tag = _recolor_style_hex(path_tag, color)
+    return path_tag
+
+
+def _recolor_style_hex(path_tag, color):
+    """Replace every #rrggbb inside the tag's style="..." values with color,
+    slicing the style values out with str.find instead of a nested re.sub"""
+    parts = []
+    pos = 0
+    start = path_tag.find('style="')
+    while start != -1:
+        end = path_tag.find('"', start + 7)
+        if end == -1:
+            break
+        parts.append(path_tag[pos:start])
+        parts.append(_HEX_COLOR_RE.sub(color, path_tag[start:end]))
+        pos = end
+        start = path_tag.find('style="', end + 1)
+    if not parts:
+        return path_tag
+    parts.append(path_tag[pos:])
+    return ''.join(parts)
+
+def _map_svg(input_file):
+    """
+    The SVG's bytes, memory-mapped instead of read and decoded into a str:
+    only the <path> tags get decoded, the text around them is copied
+    through as bytes. Line endings are normalized the way text mode did
+    when the file has any \r.
+    """
+    with open(input_file, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        svg_data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if svg_data.find(b'\r') != -1:
+        text = svg_data[:]
+        svg_data.close()
+        return text.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return svg_data
+
 
 def print_table(box_count, shores_count, frames6x4_count, frames5x4_count, framesinbox_count):
-    # Initialize colorama
-    init()
-    
     # Define colors for each category
     colors = {
         'Shores Box': Fore.RED,
@@ -26,13 +216,15 @@ def print_table(box_count, shores_count, frames6x4_count, frames5x4_count, frame
     # Table dimensions
     width = 45
     
-    print(f"\n{Fore.CYAN}{'='*width}")
-    print(f"{' DETECTED ELEMENTS ':=^{width}}")
-    print(f"{'='*width}{Style.RESET_ALL}")
-    
-    # Column headers
-    print(f"{'Category':<30} {'':^8} {'Count':>6}")
-    print(f"{'-'*width}")
+    # Built up front and written in one call rather than one print per line
+    lines = [
+        f"\n{Fore.CYAN}{'='*width}",
+        f"{' DETECTED ELEMENTS ':=^{width}}",
+        f"{'='*width}{Style.RESET_ALL}",
+        # Column headers
+        f"{'Category':<30} {'':^8} {'Count':>6}",
+        f"{'-'*width}",
+    ]
     
     # Table rows with colored bullets
     elements = [
@@ -45,22 +237,23 @@ def print_table(box_count, shores_count, frames6x4_count, frames5x4_count, frame
     
     for category, count in elements:
         color = colors[category]
-        print(
+        lines.append(
             f"{category:<30} "
             f"{color}●{Style.RESET_ALL} "
             f"{count:>6}"
         )
     
-    print(f"{'-'*width}")
+    lines.append(f"{'-'*width}")
     total = sum([box_count, shores_count, frames6x4_count, frames5x4_count, framesinbox_count])
-    print(f"{'Total elements':<30} {'':^8} {total:>6}\n")
+    lines.append(f"{'Total elements':<30} {'':^8} {total:>6}\n")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def append_counts_to_json(box_count, shores_count, frames6x4_count, frames5x4_count, framesinbox_count):
     # This function is no longer needed as we don't store objects in data.json
     # Keeping the function signature for compatibility but removing the JSON writing
     pass
 
-def apply_color_to_specific_paths(input_file, output_file, red="#fb0505", blue="#0000ff", green="#70ff00", pink="#ff00cd", orange="#fb7905", yellow="#ffff00"):
+def apply_color_to_specific_paths(input_file, output_file, red="#fb0505", blue="#0000ff", green="#70ff00", pink="#ff00cd", orange="#fb7905", yellow="#ffff00", verbose=False):
     """
     Reads an SVG file and changes colors of specific paths:
     - shores_box paths to red
@@ -69,6 +262,8 @@ def apply_color_to_specific_paths(input_file, output_file, red="#fb0505", blue="
     - frames_5x4 paths to pink
     - frames_inBox paths to orange
     - yellow_traffic_light paths to yellow
+
+    The counts table is only printed with verbose=True.
     """
     try:
         if not os.path.exists(input_file):
@@ -76,44 +271,62 @@ def apply_color_to_specific_paths(input_file, output_file, red="#fb0505", blue="
             print(f"{input_file} not found.", "error")
             return
 
-        with open(input_file, "r", encoding="utf-8") as file:
-            svg_text = file.read()
+        svg_data = _map_svg(input_file)
 
-        # Create regex patterns
-        pattern_red = "|".join(re.escape(variation) for variation in shores_box)
-        shores_box_pattern = re.compile(rf'<path[^>]+d="[^"]*({pattern_red})[^"]*"[^>]*>')
-        
-        frames6x4_pattern = re.compile(rf'<path[^>]+d="[^"]*({"|".join(re.escape(variation) for variation in frames_6x4)})[^"]*"[^>]*>')
-        
-        # Modified frames5x4 pattern including detection of diagonal segments
-        frames5x4_base_pattern = "|".join(re.escape(variation) for variation in frames_5x4)
-        # Generic diagonal pattern allowing leg lengths from 294-301px (covers 294-299/300/301)
-        frames5x4_generic = r'h\s+(?:29[4-9]|30[0-1])\s+l\s+-?(?:29[4-9]|30[0-1]),-?(?:29[4-9]|30[0-1])'
-        frames5x4_pattern = re.compile(
-            rf'<path[^>]+d="[^"]*(?:({frames5x4_base_pattern})|({frames5x4_generic}))[^"]*"[^>]*>',
-            re.IGNORECASE)
-        
-        framesinBox_pattern = re.compile(rf'<path[^>]+d="[^"]*({"|".join(re.escape(variation) for variation in frames_inBox)})[^"]*"[^>]*>')
+        def extract_path_id_number(path_tag):
+            """Numeric part of the tag's path ID (e.g. 'path13380' -> 13380), or None"""
+            id_match = re.search(r'id="([^"]+)"', path_tag)
+            if not id_match:
+                return None
+            match = re.search(r'(\d+)', id_match.group(1))
+            return int(match.group(1)) if match else None
 
-        yellow_pattern = re.compile(rf'<path[^>]+d="[^"]*({"|".join(re.escape(variation) for variation in yellow_traffic_light)})[^"]*"[^>]*>')
+        # Single pass over the <path> tags: classify each one (a tag belongs to
+        # a category when one of its d="..." values contains one of the
+        # category's variations), count it and collect the IDs of the diagonal
+        # paths (frames5x4) that will be colored pink. Only tags that will be
+        # recolored are kept for the rewrite below
+        path_tags = []
+        counts = dict.fromkeys(('red', 'blue', 'green', 'pink', 'orange'), 0)
+        diagonal_path_ids = set()
+        for match in _PATH_TAG_RE.finditer(svg_data):
+            path_tag = match.group(0).decode('utf-8')
+            d_values = _D_VALUE_RE.findall(path_tag)
+            if not d_values:
+                continue
 
-        shores_pattern = re.compile(rf'<path[^>]+d="[^"]*({"|".join(re.escape(variation) for variation in shores)})[^"]*"[^>]*>')
+            categories = set()
+            for d_value in d_values:
+                categories |= _classify(d_value)
+                if _has_leg_length(d_value) and _ADJ_294_300_RE.search(d_value):
+                    categories.add('adjacent')
+            if not categories:
+                continue
 
-        # Count matching paths
-        match_count_box = len(shores_box_pattern.findall(svg_text))
-        match_count_33_34 = len(shores_pattern.findall(svg_text))
-        match_count_frames6x4 = len(frames6x4_pattern.findall(svg_text))
-        match_count_frames5x4 = len(frames5x4_pattern.findall(svg_text))
-        match_count_framesinBox = len(framesinBox_pattern.findall(svg_text))
+            for category in categories:
+                if category in counts:
+                    counts[category] += 1
+            if 'pink' in categories:
+                path_id_num = extract_path_id_number(path_tag)
+                if path_id_num is not None:
+                    diagonal_path_ids.add(path_id_num)
+            path_tags.append((match.start(), match.end(), path_tag, categories))
 
-        # Print table with counts
-        print_table(
-            match_count_box,
-            match_count_33_34,
-            match_count_frames6x4,
-            match_count_frames5x4,
-            match_count_framesinBox
-        )
+        match_count_box = counts['red']
+        match_count_33_34 = counts['blue']
+        match_count_frames6x4 = counts['green']
+        match_count_frames5x4 = counts['pink']
+        match_count_framesinBox = counts['orange']
+
+        # Print table with counts (decoration only, so off in the pipeline)
+        if verbose:
+            print_table(
+                match_count_box,
+                match_count_33_34,
+                match_count_frames6x4,
+                match_count_frames5x4,
+                match_count_framesinBox
+            )
 
         # Append counts to JSON file
         append_counts_to_json(
@@ -124,200 +337,70 @@ def apply_color_to_specific_paths(input_file, output_file, red="#fb0505", blue="
             match_count_framesinBox
         )
 
-        # Color change functions
-        def change_to_red(match):
-            path_tag = match.group(0)
-            if "stroke" in path_tag:
-                path_tag = re.sub(r'stroke:[#0-9a-fA-F]+', f'stroke:{red}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path stroke='{red}'", 1)
-            if "fill" in path_tag:
-                path_tag = re.sub(r'fill:[#0-9a-fA-F]+', f'fill:{red}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path fill='{red}'", 1)
-            # Change colors inside style attributes
-            path_tag = re.sub(r'style="[^"]*"', lambda m: re.sub(r'#[0-9a-fA-F]{6}', red, m.group(0)), path_tag)
-            return path_tag
-
-        def change_to_blue(match):
-            path_tag = match.group(0)
-            if "stroke" in path_tag:
-                path_tag = re.sub(r'stroke:[#0-9a-fA-F]+', f'stroke:{blue}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path stroke='{blue}'", 1)
-            if "fill" in path_tag:
-                path_tag = re.sub(r'fill:[#0-9a-fA-F]+', f'fill:{blue}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path fill='{blue}'", 1)
-            return path_tag
-
-        def change_to_green(match):
-            path_tag = match.group(0)
-            if "stroke" in path_tag:
-                path_tag = re.sub(r'stroke:[#0-9a-fA-F]+', f'stroke:{green}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path stroke='{green}'", 1)
-            if "fill" in path_tag:
-                path_tag = re.sub(r'fill:[#0-9a-fA-F]+', f'fill:{green}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path fill='{green}'", 1)
-            return path_tag
-
-        def change_to_pink(match):
-            path_tag = match.group(0)
-            if "stroke" in path_tag:
-                path_tag = re.sub(r'stroke:[#0-9a-fA-F]+', f'stroke:{pink}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path stroke='{pink}'", 1)
-            if "fill" in path_tag:
-                path_tag = re.sub(r'fill:[#0-9a-fA-F]+', f'fill:{pink}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path fill='{pink}'", 1)
-            return path_tag
-
-        def change_to_orange(match):
-            path_tag = match.group(0)
-            if "stroke" in path_tag:
-                path_tag = re.sub(r'stroke:[#0-9a-fA-F]+', f'stroke:{orange}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path stroke='{orange}'", 1)
-            if "fill" in path_tag:
-                path_tag = re.sub(r'fill:[#0-9a-fA-F]+', f'fill:{orange}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path fill='{orange}'", 1)
-            return path_tag
-
-        def change_to_yellow(match):
-            path_tag = match.group(0)
-            if "stroke" in path_tag:
-                path_tag = re.sub(r'stroke:[#0-9a-fA-F]+', f'stroke:{yellow}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path stroke='{yellow}'", 1)
-            if "fill" in path_tag:
-                path_tag = re.sub(r'fill:[#0-9a-fA-F]+', f'fill:{yellow}', path_tag)
-            else:
-                path_tag = path_tag.replace("<path", f"<path fill='{yellow}'", 1)
-            return path_tag
-
-        def change_adjacent_paths_to_pink(svg_text):
+        # Color change functions, one per category
+        change_to_red = partial(_recolor_path_tag, color=red, style_hex=True)
+        change_to_blue = partial(_recolor_path_tag, color=blue)
+        change_to_green = partial(_recolor_path_tag, color=green)
+        change_to_pink = partial(_recolor_path_tag, color=pink)
+        change_to_orange = partial(_recolor_path_tag, color=orange)
+        change_to_yellow = partial(_recolor_path_tag, color=yellow)
+
+        print(f"Found {len(diagonal_path_ids)} diagonal paths with numeric IDs")
+
+        # Sorted once so each adjacency test is a binary search
+        sorted_diagonal_ids = sorted(diagonal_path_ids)
+
+        def is_adjacent(path_tag):
             """
-            Find and color adjacent paths that have lengths 294-300 pixels in their d parameter.
-            Adjacent means the path ID is within 8 positions (greater or lesser) of a pink diagonal path ID.
+            Adjacent means the path ID is within 8 positions (greater or lesser)
+            of a pink diagonal path ID.
             """
-            
-            def extract_path_id_number(path_id):
-                """Extract numeric part from path ID (e.g., 'path13380' -> 13380)"""
-                match = re.search(r'(\d+)', path_id)
-                return int(match.group(1)) if match else None
-            
-            def color_path_pink(path_tag):
-                """Apply pink color to a path tag."""
-                new_tag = path_tag
-                
-                # Handle stroke
-                if "stroke" in new_tag:
-                    new_tag = re.sub(r'stroke:[#0-9a-fA-F]+', f'stroke:{pink}', new_tag)
-                else:
-                    new_tag = new_tag.replace("<path", f"<path stroke='{pink}'", 1)
-                
-                # Handle fill
-                if "fill" in new_tag:
-                    new_tag = re.sub(r'fill:[#0-9a-fA-F]+', f'fill:{pink}', new_tag)
-                else:
-                    new_tag = new_tag.replace("<path", f"<path fill='{pink}'", 1)
-                
-                return new_tag
-            
-            # Step 1: Find all diagonal paths (frames5x4) that will be colored pink
-            diagonal_path_ids = set()
-            for match in frames5x4_pattern.finditer(svg_text):
-                path_tag = match.group(0)
-                id_match = re.search(r'id="([^"]+)"', path_tag)
-                if id_match:
-                    path_id = id_match.group(1)
-                    path_id_num = extract_path_id_number(path_id)
-                    if path_id_num is not None:
-                        diagonal_path_ids.add(path_id_num)
-                        
-                        pass  # diagonal path found
-            
-            
-            print(f"Found {len(diagonal_path_ids)} diagonal paths with numeric IDs")
-            
-            # Step 2: Find all paths that contain lengths 294-300 or "V 9114" in their d parameter
-            pattern = re.compile(r'<path[^>]+d="[^"]*(?:\b(29[4-9]|300)\b|V\s+9114)[^"]*"[^>]*>', re.IGNORECASE)
-            
-            modifications = []
-            adjacent_count = 0
-            
-            for match in pattern.finditer(svg_text):
-                path_tag = match.group(0)
-                
-                # Get path ID
-                id_match = re.search(r'id="([^"]+)"', path_tag)
-                if not id_match:
-                    continue
-                
-                path_id = id_match.group(1)
-                path_id_num = extract_path_id_number(path_id)
-                
-                if path_id_num is None:
-                    continue
-                
-                # Get the matched length
-                length = match.group(1)
-                
-                # Check if this path is adjacent to any diagonal path (within 8 positions)
-                is_adjacent = False
-                closest_diagonal = None
-                min_distance = float('inf')
-                
-                for diagonal_id in diagonal_path_ids:
-                    distance = abs(path_id_num - diagonal_id)
-                    if distance <= 8 and distance < min_distance:
-                        is_adjacent = True
-                        closest_diagonal = diagonal_id
-                        min_distance = distance
-                
-                if is_adjacent:
-                    # Get the d parameter for logging
-                    d_match = re.search(r'd="([^"]+)"', path_tag)
-                    d_str = d_match.group(1) if d_match else "unknown"
-                    
-                    
-                    pass  # found adjacent path
-                    
-                    # Color this path pink
-                    pink_tag = color_path_pink(path_tag)
-                    modifications.append((path_tag, pink_tag))
+            path_id_num = extract_path_id_number(path_tag)
+            if path_id_num is None:
+                return False
+            # First diagonal ID >= path_id_num - 8; adjacent if it is also
+            # <= path_id_num + 8
+            i = bisect_left(sorted_diagonal_ids, path_id_num - 8)
+            return i < len(sorted_diagonal_ids) and sorted_diagonal_ids[i] <= path_id_num + 8
+
+        # Apply colors tag by tag, in the order the categories override each
+        # other: red, blue, adjacent pink, pink, orange, yellow, green. Only the
+        # recolored tags are rebuilt; the text between them is copied as is
+        parts = []
+        pos = 0
+        adjacent_count = 0
+        recolors = (
+            ('red', change_to_red),
+            ('blue', change_to_blue),
+            ('adjacent', change_to_pink),
+            ('pink', change_to_pink),
+            ('orange', change_to_orange),
+            ('yellow', change_to_yellow),
+            ('green', change_to_green),
+        )
+        for start, end, original_tag, categories in path_tags:
+            path_tag = original_tag
+            if 'adjacent' in categories:
+                if is_adjacent(path_tag):
                     adjacent_count += 1
-                    
-                    pass  # colored pink
-            
-            print(f"Total adjacent paths with lengths 294-300: {adjacent_count}")
-            print(f"Total modifications to apply: {len(modifications)}")
-            
-            # Apply all modifications
-            modified_text = svg_text
-            for original_tag, pink_tag in modifications:
-                modified_text = modified_text.replace(original_tag, pink_tag)
-            
-            return modified_text
+                else:
+                    categories.discard('adjacent')
+            for category, change_color in recolors:
+                if category in categories:
+                    path_tag = change_color(path_tag)
+            if path_tag is not original_tag:
+                parts.append(svg_data[pos:start])
+                parts.append(path_tag.encode('utf-8'))
+                pos = end
+        parts.append(svg_data[pos:])
 
-        # Apply colors
-        modified_svg_text = shores_box_pattern.sub(change_to_red, svg_text)
-        modified_svg_text = shores_pattern.sub(change_to_blue, modified_svg_text)
-        
-        # First apply adjacent path coloring, then the diagonal paths
-        modified_svg_text = change_adjacent_paths_to_pink(modified_svg_text)
-        modified_svg_text = frames5x4_pattern.sub(change_to_pink, modified_svg_text)
-        modified_svg_text = framesinBox_pattern.sub(change_to_orange, modified_svg_text)
-        modified_svg_text = yellow_pattern.sub(change_to_yellow, modified_svg_text)
-        modified_svg_text = frames6x4_pattern.sub(change_to_green, modified_svg_text)
+        print(f"Total adjacent paths with lengths 294-300: {adjacent_count}")
+        print(f"Total modifications to apply: {adjacent_count}")
 
-        # Write modified content
-        with open(output_file, "w", encoding="utf-8") as file:
-            file.write(modified_svg_text)
+        # Write modified content: the parts go straight to a 1 MiB buffer
+        # instead of being joined into one more full-size copy first
+        with open(output_file, "wb", buffering=_WRITE_BUFFER_BYTES) as file:
+            file.writelines(parts)
 
         
         print("SVG file updated successfully.")
@@ -329,14 +412,9 @@ def apply_color_to_specific_paths(input_file, output_file, red="#fb0505", blue="
 def svg_to_png(svg_path, png_path):
     """Convert SVG to PNG format"""
     try:
-        # Convert SVG to PNG bytes
-        png_data = cairosvg.svg2png(url=svg_path)
-        
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(png_data))
-        
-        # Save as PNG
-        image.save(png_path, 'PNG')
+        # cairosvg already emits a PNG: write it straight to disk instead of
+        # decoding and re-encoding it through PIL
+        cairosvg.svg2png(url=svg_path, write_to=png_path)
         
         print(f"✅ SVG converted to PNG: {png_path}")
         return True
@@ -10,15 +10,46 @@ from pathlib import Path
 import argparse
 import re
 import os
+import mmap
+import hashlib
 import shutil
 import sys
-import json
 from datetime import datetime
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import cairosvg
 import io
 from PIL import Image
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from utils.json_store import dumps_json
+
+# Server root, resolved once from this file so the cache works from any cwd
+_ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Rasterized SVGs are cached on disk keyed by a hash of the SVG bytes and the
+# cairosvg version, so re-running the pipeline on an unchanged drawing skips
+# the cairosvg render. Lives outside files/, which the pipeline wipes on every
+# run, so it is kept to RASTER_CACHE_MAX_MB (default 256) by evicting the
+# least recently used PNGs after every store. Set RASTER_CACHE_DIR to relocate
+# it, or RASTER_NO_CACHE=1 to bypass.
+RASTER_CACHE_DIR = Path(os.getenv(
+    'RASTER_CACHE_DIR',
+    _ROOT_DIR / '.cache' / 'svg_raster'
+))
+RASTER_CACHE_MAX_BYTES = int(float(os.getenv('RASTER_CACHE_MAX_MB', '256')) * 1024 * 1024)
+
+# Contours whose centers are closer than this (px) are grouped into one X shape
+GROUP_DISTANCE = 15
+
+# 3x3 rectangular structuring element for cleaning up the blue mask. Built
+# once; OpenCV runs all-ones rectangles through its separable min/max path
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+# Hex color codes (#xxxxxx) that process_svg_colors turns into #202124: every
+# one except #0000ff and #fb0505 (any case), which the lookahead skips so the
+# substitution needs no per-match Python callback
+_RECOLORED_HEX_RE = re.compile(rb'#(?!0000[fF][fF]|[fF][bB]0505)[0-9a-fA-F]{6}')
+
+# Output buffer for writing Step6.svg
+_WRITE_BUFFER_BYTES = 1 << 20
 
 
 def save_x_shapes_to_json(x_shapes_data, output_path):
@@ -30,9 +61,9 @@ def save_x_shapes_to_json(x_shapes_data, output_path):
             "x_shapes": x_shapes_data
         }
         
-        # Write to JSON file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
+        # Write to JSON file (orjson when available), in a single write
+        with open(output_path, 'wb') as f:
+            f.write(dumps_json(json_data))
         
         print(f"X shapes data saved to: {output_path}")
         return True
@@ -40,11 +71,85 @@ def save_x_shapes_to_json(x_shapes_data, output_path):
         print(f"Error saving X shapes data to JSON: {e}")
         return False
 
+def _raster_cache_enabled():
+    """False when RASTER_NO_CACHE is set"""
+    return os.getenv('RASTER_NO_CACHE', '').lower() not in ('1', 'true', 'yes')
+
+def _raster_cache_path(svg_path):
+    """Cache file for the PNG rendering of the SVG at svg_path"""
+    digest = hashlib.sha256()
+    digest.update(f"{getattr(cairosvg, '__version__', '')}\0".encode('utf-8'))
+    with open(svg_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return RASTER_CACHE_DIR / f"{digest.hexdigest()}.png"
+
+def rasterize_svg(svg_path):
+    """PNG bytes of the SVG, from the raster cache when it was rendered before"""
+    if not _raster_cache_enabled():
+        return cairosvg.svg2png(url=svg_path)
+
+    cache_path = _raster_cache_path(svg_path)
+    try:
+        png_data = cache_path.read_bytes()
+    except OSError:
+        pass
+    else:
+        # Refresh the mtime so eviction drops the least recently used entries
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return png_data
+
+    png_data = cairosvg.svg2png(url=svg_path)
+
+    # Written to a temp file and swapped in, so a concurrent run never reads
+    # a half-written PNG
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp.{os.getpid()}")
+    try:
+        RASTER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_bytes(png_data)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"⚠️  Could not cache rasterized SVG: {e}")
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+    else:
+        _prune_raster_cache(keep=cache_path)
+    return png_data
+
+def _prune_raster_cache(keep=None):
+    """Delete the least recently used cached PNGs (oldest mtime first) until
+    the cache fits in RASTER_CACHE_MAX_BYTES; `keep` is never deleted"""
+    entries = []
+    total = 0
+    for path in RASTER_CACHE_DIR.glob('*.png'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= RASTER_CACHE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+
 def svg_to_image(svg_path, output_path=None):
     """Convert SVG to PIL Image"""
     try:
         # Convert SVG to PNG bytes
-        png_data = cairosvg.svg2png(url=svg_path)
+        png_data = rasterize_svg(svg_path)
         
         # Convert to PIL Image
         image = Image.open(io.BytesIO(png_data))
@@ -61,21 +166,78 @@ def svg_to_image(svg_path, output_path=None):
         print(f"Error converting SVG to image: {e}", "error")
         return None
 
-def detect_blue_x_shapes(image_path, output_path='results.png', json_output_path=None):
-    """Detect individual blue X shapes using contour detection"""
+def svg_to_bgr(svg_path):
+    """Convert SVG to an OpenCV BGR image, decoding the PNG bytes directly
+    (no PIL image, intermediate array or color conversion). Alpha is dropped
+    the same way the PIL + cvtColor route did"""
+    try:
+        png_data = rasterize_svg(svg_path)
+        return cv2.imdecode(np.frombuffer(png_data, np.uint8), cv2.IMREAD_COLOR)
+    except Exception as e:
+        
+        print(f"Error converting SVG to image: {e}", "error")
+        return None
+
+def _save_result_image(img, valid_contours, boxes, output_path, draw_labels=True):
+    """Draw the grouped contours, bounding boxes and labels on a copy of img
+    and write it to output_path (as PNG when output_path ends in .svg)"""
+    result_img = img.copy()
+    
+    # Draw all contours and all bounding boxes with one call each. Every
+    # overlay is the same solid green, so the pixels match drawing the
+    # shapes one by one
+    if valid_contours:
+        group_contours = [contour for contours_group, *_ in valid_contours
+                          for contour, *_ in contours_group]
+        cv2.drawContours(result_img, group_contours, -1, (0, 255, 0), 1)
+        
+        corners = boxes.astype(np.int32)
+        corners[:, 2:] += corners[:, :2]
+        rect_polys = corners[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+        cv2.polylines(result_img, list(rect_polys), True, (0, 255, 0), 2)
+    
+    # Add labels
+    if draw_labels:
+        for i, (x, y) in enumerate(boxes[:, :2].astype(np.int32).tolist()):
+            cv2.putText(result_img, f"X{i+1}", (x, y-10), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    
+    # Save result image
+    if output_path.lower().endswith('.svg'):
+        # For now, save as PNG with SVG extension (you might want to convert back to SVG)
+        png_path = output_path.replace('.svg', '.png')
+        cv2.imwrite(png_path, result_img)
+        print(f"Result saved as: {png_path} (PNG format)")
+    else:
+        cv2.imwrite(output_path, result_img)
+        print(f"Result saved as: {output_path}")
+
+def detect_blue_x_shapes(image_path, output_path='results.png', json_output_path=None, input_scale=1.0,
+                         draw_labels=True, render_output=True):
+    """Detect individual blue X shapes using contour detection
+
+    With input_scale < 1 the blue mask is downsampled by that factor before
+    the morphology and contour passes, and the contours are scaled back to
+    full-resolution coordinates. Faster on large renders, but thin strokes
+    can drop out, so the pipeline keeps the default of 1.0 (full resolution).
+    
+    draw_labels=False leaves the "X<n>" labels off the result image, and
+    render_output=False skips drawing and writing it altogether.
+    """
     
     print(f"Processing image: {image_path}")
     
+    if not 0 < input_scale <= 1:
+        print(f"Error: input_scale must be in (0, 1], got {input_scale}", "error")
+        return 0, []
+    
     # Check if input is SVG and convert if needed
     if str(image_path).lower().endswith('.svg'):
         
         print("Converting SVG to image for processing...")
-        pil_image = svg_to_image(image_path)
-        if pil_image is None:
+        img = svg_to_bgr(image_path)
+        if img is None:
             return 0, []
-        
-        # Convert PIL Image to OpenCV format
-        img = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
     else:
         # Read image directly if it's not SVG
         img = cv2.imread(str(image_path))
@@ -96,31 +258,44 @@ def detect_blue_x_shapes(image_path, output_path='results.png', json_output_path
     # Create mask for blue objects
     blue_mask = cv2.inRange(hsv, lower_blue, upper_blue)
     
+    if input_scale != 1:
+        blue_mask = cv2.resize(blue_mask, None, fx=input_scale, fy=input_scale,
+                               interpolation=cv2.INTER_NEAREST)
+    
     # Apply morphological operations to clean up the mask
-    kernel = np.ones((3,3), np.uint8)
-    blue_mask = cv2.morphologyEx(blue_mask, cv2.MORPH_CLOSE, kernel)
-    blue_mask = cv2.morphologyEx(blue_mask, cv2.MORPH_OPEN, kernel)
+    blue_mask = cv2.morphologyEx(blue_mask, cv2.MORPH_CLOSE, MORPH_KERNEL)
+    blue_mask = cv2.morphologyEx(blue_mask, cv2.MORPH_OPEN, MORPH_KERNEL)
     
     # Find contours
     contours, _ = cv2.findContours(blue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    # Filter contours based on area and shape
-    valid_contours = []
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        
-        # Filter by area (adjust these values based on your X shapes)
-        if 30 < area < 2000:  # Broader range to catch all potential X shapes
-            # Get bounding rectangle
-            x, y, w, h = cv2.boundingRect(contour)
-            
-            # Check aspect ratio (X shapes should be roughly square)
-            aspect_ratio = w / h if h > 0 else 0
-            # Ensure width/height ratio is within 1.5 tolerance (max 1.5:1 or 1:1.5)
-            if 0.67 < aspect_ratio < 1.5:  # 1/1.5 = 0.67, 1.5/1 = 1.5
-                # Additional check: ensure reasonable size
-                if w >= 5 and h >= 5:  # Minimum size requirement
-                    valid_contours.append((contour, x, y, w, h, area))
+    if input_scale != 1:
+        # Back to full-resolution coordinates, so the size thresholds below and
+        # the drawing on the full-size image stay in original pixels
+        contours = [np.round(contour / input_scale).astype(np.int32) for contour in contours]
+    
+    # Filter contours based on area and shape, as array operations over all
+    # contours at once instead of one Python branch per contour
+    areas = np.fromiter((cv2.contourArea(contour) for contour in contours),
+                        dtype=np.float64, count=len(contours))
+    rects = np.array([cv2.boundingRect(contour) for contour in contours],
+                     dtype=np.int64).reshape(-1, 4)
+    widths, heights = rects[:, 2], rects[:, 3]
+
+    # Filter by area (adjust these values based on your X shapes)
+    keep = (areas > 30) & (areas < 2000)  # Broader range to catch all potential X shapes
+    # Additional check: ensure reasonable size
+    keep &= (widths >= 5) & (heights >= 5)  # Minimum size requirement
+    # Check aspect ratio (X shapes should be roughly square): ensure
+    # width/height ratio is within 1.5 tolerance (max 1.5:1 or 1:1.5)
+    aspect_ratios = widths / np.maximum(heights, 1)
+    keep &= (aspect_ratios > 0.67) & (aspect_ratios < 1.5)  # 1/1.5 = 0.67, 1.5/1 = 1.5
+
+    valid_contours = [
+        (contours[index], x, y, w, h, area)
+        for index, (x, y, w, h), area in zip(
+            np.flatnonzero(keep).tolist(), rects[keep].tolist(), areas[keep].tolist())
+    ]
     
     print(f"Found {len(valid_contours)} initial contours")
     
@@ -129,10 +304,18 @@ def detect_blue_x_shapes(image_path, output_path='results.png', json_output_path
         # Sort by area to prioritize larger contours
         valid_contours.sort(key=lambda x: x[5], reverse=True)
         
-        # Group contours that are close to each other
+        # Group contours that are close to each other. Centers are bucketed
+        # into a grid of GROUP_DISTANCE-sized cells, so only the 3x3 cells
+        # around a contour need to be searched instead of every contour
         grouped_contours = []
         used_indices = set()
-        
+
+        centers = [(x + w/2, y + h/2) for _, x, y, w, h, _ in valid_contours]
+        cells = [(int(cx // GROUP_DISTANCE), int(cy // GROUP_DISTANCE)) for cx, cy in centers]
+        buckets = {}
+        for j, cell in enumerate(cells):
+            buckets.setdefault(cell, []).append(j)
+
         for i, (contour, x, y, w, h, area) in enumerate(valid_contours):
             if i in used_indices:
                 continue
@@ -141,22 +324,26 @@ def detect_blue_x_shapes(image_path, output_path='results.png', json_output_path
             nearby_contours = [(contour, x, y, w, h, area)]
             used_indices.add(i)
             
-            center_x = x + w/2
-            center_y = y + h/2
+            center_x, center_y = centers[i]
+            cell_x, cell_y = cells[i]
+            candidates = []
+            for gx in (cell_x - 1, cell_x, cell_x + 1):
+                for gy in (cell_y - 1, cell_y, cell_y + 1):
+                    candidates.extend(buckets.get((gx, gy), ()))
             
-            for j, (contour2, x2, y2, w2, h2, area2) in enumerate(valid_contours):
+            # Same order as a scan over all contours
+            for j in sorted(candidates):
                 if j in used_indices:
                     continue
                     
-                center_x2 = x2 + w2/2
-                center_y2 = y2 + h2/2
+                center_x2, center_y2 = centers[j]
                 
                 # Calculate distance between centers
                 distance = ((center_x - center_x2)**2 + (center_y - center_y2)**2)**0.5
                 
                 # If contours are very close, group them (much stricter for X shapes)
-                if distance < 15:  # Reduced from 30 to 15 for tighter grouping
-                    nearby_contours.append((contour2, x2, y2, w2, h2, area2))
+                if distance < GROUP_DISTANCE:  # Reduced from 30 to 15 for tighter grouping
+                    nearby_contours.append(valid_contours[j])
                     used_indices.add(j)
             
             # Calculate combined bounding box for the group
@@ -181,53 +368,32 @@ def detect_blue_x_shapes(image_path, output_path='results.png', json_output_path
         valid_contours = grouped_contours
         print(f"Grouped into {len(valid_contours)} X shapes")
     
-    # Collect X shapes data for JSON output
-    x_shapes_data = []
-    
-    # Draw results
-    result_img = img.copy()
-    
-    # Draw contours and bounding boxes
-    for i, (contours_group, x, y, w, h) in enumerate(valid_contours):
-        # Draw all contours in the group
-        for contour, _, _, _, _, _ in contours_group:
-            cv2.drawContours(result_img, [contour], -1, (0, 255, 0), 1)
-        
-        # Draw bounding box around the group
-        cv2.rectangle(result_img, (int(x), int(y)), (int(x + w), int(y + h)), (0, 255, 0), 2)
-        
-        # Add label
-        label = f"X{i+1}"
-        cv2.putText(result_img, label, (int(x), int(y)-10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        # Collect data for JSON
-        x_shape_data = {
+    # Collect X shapes data for JSON output. The float fields are computed
+    # as columns of one array, and tolist() turns them into Python floats
+    boxes = np.array([(x, y, w, h) for _, x, y, w, h in valid_contours],
+                     dtype=np.float64).reshape(-1, 4)
+    xs, ys, ws, hs = boxes.T
+    rows = np.column_stack((xs, ys, ws, hs, xs + ws / 2, ys + hs / 2, ws * hs)).tolist()
+    x_shapes_data = [
+        {
             "id": i + 1,
-            "x": float(x),
-            "y": float(y),
-            "width": float(w),
-            "height": float(h),
-            "center_x": float(x + w / 2),
-            "center_y": float(y + h / 2),
-            "area": float(w * h),
+            "x": x,
+            "y": y,
+            "width": w,
+            "height": h,
+            "center_x": center_x,
+            "center_y": center_y,
+            "area": area,
             "contours_count": len(contours_group)
         }
-        x_shapes_data.append(x_shape_data)
-        
-        pass  # X shape detected
+        for i, ((contours_group, *_), (x, y, w, h, center_x, center_y, area))
+        in enumerate(zip(valid_contours, rows))
+    ]
     
-    # Save result image
-    if output_path.lower().endswith('.svg'):
-        # Convert back to PIL and save as SVG-compatible format
-        result_pil = Image.fromarray(cv2.cvtColor(result_img, cv2.COLOR_BGR2RGB))
-        # For now, save as PNG with SVG extension (you might want to convert back to SVG)
-        png_path = output_path.replace('.svg', '.png')
-        cv2.imwrite(png_path, result_img)
-        print(f"Result saved as: {png_path} (PNG format)")
-    else:
-        cv2.imwrite(output_path, result_img)
-        print(f"Result saved as: {output_path}")
+    # Draw and save the result image (a debug visualization; the pipeline
+    # only consumes the JSON)
+    if render_output:
+        _save_result_image(img, valid_contours, boxes, output_path, draw_labels)
     
     # Save X shapes data to JSON if path provided
     if json_output_path:
@@ -237,32 +403,36 @@ def detect_blue_x_shapes(image_path, output_path='results.png', json_output_path
     
     return len(valid_contours), x_shapes_data
 
+def _map_svg(input_svg):
+    """
+    The SVG's bytes, memory-mapped rather than read into memory. Line
+    endings are normalized the way text mode did when the file has any \r.
+    """
+    with open(input_svg, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if content.find(b'\r') != -1:
+        text = content[:]
+        content.close()
+        return text.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return content
+
 def process_svg_colors(input_svg, output_svg):
     """
     Process SVG colors by replacing most hex colors with #202124,
     while keeping #0000ff and #fb0505 unchanged.
     """
     try:
-        # Read the SVG file
-        with open(input_svg, 'r', encoding='utf-8') as file:
-            content = file.read()
+        # Map the SVG file: the colors are ASCII, so the regex runs over the
+        # raw bytes and the document is never decoded or copied into a str
+        content = _map_svg(input_svg)
         
-        # Find all hex color codes (#xxxxxx)
-        hex_pattern = r'#([0-9a-fA-F]{6})'
-        
-        def replace_color(match):
-            color = match.group(1).lower()
-            # Keep #0000ff and #fb0505 unchanged, replace all others with #202124
-            if color == '0000ff' or color == 'fb0505':
-                return match.group(0)  # Return original match unchanged
-            else:
-                return '#202124'
-        
-        # Replace colors using the function
-        processed_content = re.sub(hex_pattern, replace_color, content)
+        # Replace all hex color codes (#xxxxxx) except #0000ff and #fb0505
+        processed_content = _RECOLORED_HEX_RE.sub(b'#202124', content)
         
         # Write the processed content to a new file
-        with open(output_svg, 'w', encoding='utf-8') as file:
+        with open(output_svg, 'wb', buffering=_WRITE_BUFFER_BYTES) as file:
             file.write(processed_content)
         
         
@@ -277,6 +447,11 @@ def process_svg_colors(input_svg, output_svg):
         
         print(f"Error processing SVG: {e}", "error")
 
+def _debug_result_images():
+    """True when DEBUG_RESULT_IMAGES is set: the pipeline then also writes
+    the Step6-results.png visualization"""
+    return os.getenv('DEBUG_RESULT_IMAGES', '').lower() in ('1', 'true', 'yes')
+
 def run_step6():
     """
     Run Step5 processing - detect blue X shapes
@@ -304,7 +479,8 @@ def run_step6():
         # Then detect blue X shapes on the processed SVG
         
         print(f"Detecting blue X shapes in: {output_svg}")
-        count, x_shapes_data = detect_blue_x_shapes(output_svg, output_results, json_output)
+        count, x_shapes_data = detect_blue_x_shapes(output_svg, output_results, json_output,
+                                                     render_output=_debug_result_images())
         print(f"\nFinal count: {count} blue X shapes")
         
         return True
@@ -320,6 +496,8 @@ def main():
                        help='Path to image')
     parser.add_argument('--output', type=str, default='results.png',
                        help='Output image path')
+    parser.add_argument('--scale', type=float, default=1.0,
+                       help='Downsample factor for the mask (0-1], 1 = full resolution')
     
     args = parser.parse_args()
     
@@ -331,7 +509,7 @@ def main():
         return
     
     # Detect X shapes
-    count, x_shapes_data = detect_blue_x_shapes(source_path, args.output)
+    count, x_shapes_data = detect_blue_x_shapes(source_path, args.output, input_scale=args.scale)
     
     print(f"\nFinal count: {count} blue X shapes")
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Steps 2+3 fused: recolor the SVG and add the background in one in-memory pass
+Reads Step1.svg once and writes Step2.svg and Step3.svg without re-reading
+Step2.svg from disk in between.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from processors.Step2 import modify_svg_stroke_and_fill
+from processors.Step3 import BACKGROUND_COLOR, add_background_to_svg_text
+
+_FILES_DIR = Path(__file__).resolve().parent.parent / 'files'
+
+
+def run_2_3(svg_text, background_color=BACKGROUND_COLOR):
+    """
+    Apply Step2 (colors) and Step3 (background) to svg_text
+
+    Returns:
+        (step2_svg, step3_svg): both stages, since Step11 draws onto Step2.svg
+        and detection reads Step3.svg
+    """
+    step2_svg = modify_svg_stroke_and_fill(svg_text)
+    return step2_svg, add_background_to_svg_text(step2_svg, background_color)
+
+
+def run_step2_3():
+    """
+    Main function to run the fused Step2 + Step3 processing
+    """
+    try:
+        input_svg = _FILES_DIR / 'Step1.svg'
+        step2_svg_path = _FILES_DIR / 'Step2.svg'
+        step3_svg_path = _FILES_DIR / 'Step3.svg'
+
+        # Check if input file exists
+        if not input_svg.exists():
+            print(f"Error: Input file '{input_svg}' not found!")
+            return False
+
+        with open(input_svg, "r", encoding="utf-8") as file:
+            svg_text = file.read()
+
+        print("Modifying colors and adding background...")
+        step2_svg, step3_svg = run_2_3(svg_text)
+
+        with open(step2_svg_path, "w", encoding="utf-8") as file:
+            file.write(step2_svg)
+        with open(step3_svg_path, "w", encoding="utf-8") as file:
+            file.write(step3_svg)
+
+        print(f"✅ Step2 + Step3 completed successfully:")
+        print(f"   - Input SVG: {input_svg}")
+        print(f"   - Colored SVG: {step2_svg_path}")
+        print(f"   - Background SVG: {step3_svg_path}")
+        return True
+
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+        return False
+
+# Main execution
+if __name__ == "__main__":
+    run_step2_3()
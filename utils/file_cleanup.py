@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+File Cleanup Utility
+Removes pipeline intermediates from files/ and the server root once results are stored
+"""
+
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+# Intermediate artifacts removed from files/ once results are stored:
+#   - Step1-10 SVGs and the dual pipeline (slab band) SVG/PNG variants
+#   - Step4-10 result PNGs, including the slab band variants
+_IS_RESULT_FILE = re.compile(
+    r"Step(?:[1-9]|10)\.svg"
+    r"|Step3_(?:no_slab_band|with_slab_band(?:_flattened)?)\.svg"
+    r"|Step3_with_slab_band_temp\.png"
+    r"|Step10_(?:no|with)_slab_band(?:-results\.png|\.svg)"
+    r"|Step(?:[4-9]|10)-results\.png"
+).fullmatch
+
+# JSON result files written next to data.json
+_IS_ROOT_JSON = re.compile(
+    r"(?:green|pink|orange)Frames\.json|(?:x|square)-shores\.json"
+).fullmatch
+
+# Intermediate directories left behind by the pipeline, relative to files/:
+#   - tempData/  : per-step JSON sidecars (already folded into data.json)
+#   - groups/    : per-group SVG crops + wood overlays (Step16/17 outputs)
+#   - tempData/no_slab_band : legacy slab-band branch comparison crops
+# All are safe to delete once data.json has been built and posted.
+_RESULT_DIR_NAMES = (
+    Path("tempData") / "no_slab_band",
+    Path("tempData"),
+    Path("groups"),
+)
+
+
+# Server root and result locations, resolved once from this module's path so
+# cleanup doesn't depend on the process cwd
+_ROOT_DIR = Path(__file__).resolve().parent.parent
+_FILES_DIR = _ROOT_DIR / "files"
+_RESULT_DIRS = tuple(_FILES_DIR / dir_name for dir_name in _RESULT_DIR_NAMES)
+
+
+def _matching_files(dir_path, is_target):
+    """Paths of the entries in dir_path whose names match is_target, from a
+    single directory read (empty if the directory doesn't exist)"""
+    try:
+        with os.scandir(dir_path) as entries:
+            return sorted(Path(entry.path) for entry in entries if is_target(entry.name))
+    except FileNotFoundError:
+        return []
+
+
+_UNLINK_WORKERS = 8
+
+
+def _safe_unlink(file_path):
+    """Unlink file_path. Returns True if removed, False if it was already gone,
+    or the raised exception for any other failure."""
+    try:
+        os.unlink(file_path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        return e
+
+
+def cleanup_result_files():
+    """Delete all step result files from the files folder"""
+    try:
+        print(f"\n🧹 Cleaning up result files...")
+
+        root_dir = _ROOT_DIR
+        files_dir = _FILES_DIR
+
+        for dir_path in _RESULT_DIRS:
+            if dir_path.exists():
+                try:
+                    shutil.rmtree(dir_path)
+                    print(f"   ✅ Deleted directory: {dir_path}")
+                except Exception as e:
+                    print(f"   ⚠️  Could not delete {dir_path}: {e}")
+
+        # One directory read per folder instead of a stat per candidate file;
+        # only names that are actually present get unlinked.
+        files_to_delete = (
+            _matching_files(files_dir, _IS_RESULT_FILE)
+            + _matching_files(root_dir, _IS_ROOT_JSON)
+        )
+
+        # Unlinks are independent, so overlap their I/O waits (noticeable on
+        # network/container mounts); results are reported in list order.
+        deleted_count = 0
+        if files_to_delete:
+            with ThreadPoolExecutor(max_workers=min(_UNLINK_WORKERS, len(files_to_delete))) as executor:
+                results = list(executor.map(_safe_unlink, files_to_delete))
+            for file_path, result in zip(files_to_delete, results):
+                if result is True:
+                    deleted_count += 1
+                    print(f"   ✅ Deleted: {file_path.name}")
+                elif isinstance(result, Exception):
+                    print(f"   ⚠️  Could not delete {file_path.name}: {result}")
+
+        print(f"\n✅ Cleaned up {deleted_count} result files")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error during cleanup: {e}")
+        return False
+
+
+def clear_directory(dir_path) -> int:
+    """Remove every entry inside dir_path (the directory itself is kept).
+
+    Returns the number of top-level entries removed; a missing directory counts
+    as already empty."""
+    removed_count = 0
+    try:
+        entries = list(os.scandir(dir_path))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+        removed_count += 1
+    return removed_count
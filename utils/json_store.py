@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+JSON Store Utility
+Locked, atomic read/modify/write helpers for data.json and other pipeline JSON files
+"""
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, fall back to unlocked writes
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # optional C accelerator; stdlib json is the fallback
+    orjson = None
+
+
+@contextmanager
+def json_file_lock(path: str):
+    """Hold an exclusive advisory lock on `<path>.lock` for the duration of the block"""
+    if fcntl is None:
+        yield
+        return
+
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# In-process locks for key_lock: key -> [lock, number of holders/waiters]
+_key_locks: Dict[str, list] = {}
+_key_locks_guard = threading.Lock()
+
+
+@contextmanager
+def key_lock(key: str):
+    """Serialize this process's threads on `key` without a lock file on disk.
+
+    For files that are written atomically (write_json_atomic) and so can be
+    read without json_file_lock, when threads still need to wait for each
+    other's work. The entry for `key` is dropped once nobody holds it."""
+    with _key_locks_guard:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[key]
+
+
+def loads_json(raw: bytes) -> Any:
+    """Parse JSON bytes (orjson when available, stdlib json otherwise)"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps_json(data: Any, pretty: bool = True) -> bytes:
+    """Serialize to UTF-8 JSON bytes.
+
+    pretty=True gives 2-space indentation (the only indent orjson supports),
+    pretty=False the compact form without spaces. The stdlib fallback produces
+    the same bytes (short of exponent spelling, 1e-7 vs 1e-07), so files look
+    the same whether or not orjson is installed. data.json used to be written
+    with 4-space indentation; files written here are 2-space. Objects orjson
+    rejects (e.g. non-string keys) fall back to the stdlib encoder."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+        except TypeError:
+            pass
+    if pretty:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def read_json(path: str) -> Any:
+    """Read and parse a JSON file; raises FileNotFoundError / json.JSONDecodeError"""
+    with open(path, 'rb') as f:
+        return loads_json(f.read())
+
+
+def load_json(path: str, default: Optional[Any] = None) -> Any:
+    """Load a JSON file, returning `default` if it is missing or invalid"""
+    try:
+        return read_json(path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def write_json_atomic(path: str, data: Any, pretty: bool = True) -> None:
+    """Write JSON to a temp file next to `path` and swap it in with os.replace.
+
+    The temp file is fsynced before the rename, so after a crash `path` holds
+    either the old or the new contents - never a truncated file."""
+    payload = dumps_json(data, pretty=pretty)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def update_json(path: str, updates: Dict[str, Any], pretty: bool = True) -> Dict[str, Any]:
+    """Merge `updates` into the JSON object at `path` under the file lock.
+
+    The read-modify-write happens while the lock is held, so two steps updating
+    data.json at the same time cannot drop each other's keys."""
+    with json_file_lock(path):
+        data = load_json(path, default={})
+        if not isinstance(data, dict):
+            data = {}
+        data.update(updates)
+        write_json_atomic(path, data, pretty=pretty)
+    return data
+
+
+def append_json_key(path: str, key: str, value: Any) -> bool:
+    """Add a new top-level key to the JSON object at `path` without rewriting it.
+
+    Only the closing brace is overwritten with `, "key": value}`, so the cost is
+    independent of the file size. Returns False (file untouched) when the key
+    may already exist or the file doesn't end in a JSON object, in which case
+    the caller should fall back to a full write. Call with the file lock held."""
+    encoded_key = dumps_json(key, pretty=False)
+    entry = encoded_key + b': ' + dumps_json(value, pretty=False)
+    with open(path, 'r+b') as f:
+        raw = f.read()
+        if encoded_key in raw:
+            return False
+        end = len(raw.rstrip())
+        if end == 0 or raw[end - 1:end] != b'}':
+            return False
+        body = raw[:end - 1].rstrip()
+        if not body.startswith(b'{'):
+            return False
+        separator = b'\n' if body == b'{' else b',\n'
+        f.seek(len(body))
+        f.write(separator + b'  ' + entry + b'\n}\n')
+        f.truncate()
+    return True